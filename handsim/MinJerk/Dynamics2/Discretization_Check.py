@@ -0,0 +1,125 @@
+"""
+Compare the closed form discretization (analytic_mode=True, see Joint_1dof.analytic_discretization) with torch.matrix_exp
+Run from MinJerk: python -m Dynamics2.Discretization_Check
+
+1. Ad, Bd0 and Bd1 of both in float64, against each other, over stiffnesses from ~0 to well above the trained range.
+   The two are the same matrix exponential, so they agree to rounding: TOL_FLOAT64.
+2. Joint_1dof and Hand_4dof with random parameters, one step from the same system states, both modes in float32.
+   Here they differ by the float32 rounding of each, mostly of matrix_exp: up to ~2e-4 absolute on velocities of ~40, ~1e-5 of
+   the largest state. TOL_FLOAT32 is relative to the largest state. The same models in float64 agree to TOL_FLOAT64.
+
+analytic_mode only pays off for large batches (training, or many trajectories at once), where the whole step is ~1.5x faster.
+At batch size 1 it does not speed up inference: depending on the machine a step takes about as long as with matrix_exp
+or up to ~2x longer. The timings on this machine are printed at the end.
+"""
+
+import time
+import torch
+from Dynamics2.Muscle import Muscle
+from Dynamics2.Joint_1dof_Bilinear_NN import Joint_1dof
+from Dynamics2.Hand_4dof import Hand_4dof
+
+TOL_FLOAT64 = 1e-9
+TOL_FLOAT32 = 5e-5
+dt = 1/60
+
+
+def matrix_exp_discretization(K, I, B10, B11, dt):
+    """Ad, Bd0 and Bd1 the way Joint_1dof.forward builds them with torch.matrix_exp"""
+    batch_size = len(K)
+    A = torch.zeros(batch_size, 2, 2, dtype=K.dtype)
+    A[:, 0, 1] = 1
+    A[:, 1, 0] = -(K/I)[:, 0]
+    A[:, 1, 1] = -(2*torch.sqrt(K*I)/I)[:, 0]
+    B = torch.zeros(batch_size, 2, 2, dtype=K.dtype)
+    B[:, 1, 0] = B10[:, 0]
+    B[:, 1, 1] = B11[:, 0]
+    M = torch.zeros(batch_size, 6, 6, dtype=K.dtype)
+    M[:, :2, :2] = A*dt
+    M[:, :2, 2:4] = B*dt
+    M[:, 2:4, 4:] = torch.eye(2, dtype=K.dtype)
+
+    expMT = torch.matrix_exp(M)
+    Ad = expMT[:, :2, :2]
+    Bd1 = expMT[:, :2, 4:]
+    Bd0 = expMT[:, :2, 2:4] - Bd1
+    return Ad, Bd0, Bd1
+
+
+def check_discretization():
+    K = torch.logspace(-8, 4, 200, dtype=torch.float64).view(-1, 1)
+    I = torch.tensor(0.008, dtype=torch.float64)
+    B10 = torch.rand(len(K), 1, dtype=torch.float64)
+    B11 = torch.full((len(K), 1), float(1/I), dtype=torch.float64)
+
+    analytic = Joint_1dof.analytic_discretization(K, I, B10, B11, dt, torch.float64)
+    reference = matrix_exp_discretization(K, I, B10, B11, dt)
+    error = max(float((a - r).abs().max()) for a, r in zip(analytic, reference))
+    print(f'Ad, Bd0, Bd1 in float64: max abs difference {error:.1e} (tolerance {TOL_FLOAT64:.0e})')
+    return error <= TOL_FLOAT64
+
+
+def random_models(build, dtype):
+    """The same randomly perturbed model with matrix_exp and with the closed form"""
+    torch.manual_seed(1)
+    model_expm = build(False)
+    state_dict = model_expm.state_dict()
+    for k in state_dict:
+        state_dict[k] = state_dict[k]*(1 + 0.5*torch.rand_like(state_dict[k]))
+    model_analytic = build(True)
+    model_expm.load_state_dict(state_dict)
+    model_analytic.load_state_dict(state_dict)
+    return model_expm.to(dtype).eval(), model_analytic.to(dtype).eval()
+
+
+def check_model(name, build, state_size, input_size, dtype, tolerance, steps=600, batch_size=5):
+    model_expm, model_analytic = random_models(build, dtype)
+    torch.manual_seed(5)
+    error = 0
+    abs_error = 0
+    with torch.no_grad():
+        SS = torch.zeros(batch_size, state_size, dtype=dtype)
+        for i in range(steps):
+            # Bursts of activation, so the states swing up and settle back
+            inputs = torch.rand(batch_size, input_size, dtype=dtype)*(i % 100 < 50)
+            SS_analytic = model_analytic(SS, inputs, dt)[1]
+            SS = model_expm(SS, inputs, dt)[1]
+            difference = float((SS - SS_analytic).abs().max())
+            abs_error = max(abs_error, difference)
+            error = max(error, difference/float(SS.abs().max().clamp(min=1)))
+    print(f'{name} in {dtype}: max one step difference {error:.1e} of the largest state (tolerance {tolerance:.0e}), {abs_error:.1e} absolute')
+    return error <= tolerance
+
+
+def time_model(name, build, state_size, input_size, batch_size, runs=300):
+    for analytic_mode in (False, True):
+        model = build(analytic_mode).eval()
+        model.freeze()
+        SS = torch.zeros(batch_size, state_size)
+        inputs = torch.rand(batch_size, input_size)
+        with torch.no_grad():
+            for _ in range(20):
+                model(SS, inputs, dt)
+            start = time.perf_counter()
+            for _ in range(runs):
+                model(SS, inputs, dt)
+        print(f'{name} batch {batch_size} {"analytic" if analytic_mode else "matrix_exp"}: {(time.perf_counter() - start)/runs*1e3:.3f} ms')
+
+
+if __name__ == '__main__':
+    device = torch.device('cpu')
+    models = [('Joint_1dof', lambda analytic_mode: Joint_1dof(device, [Muscle(100, 2000, 0.06, 0.006, [-0.05]), Muscle(100, 2000, 0.06, 0.006, [0.05])],
+                                                                [0.004], 5, 0.3, analytic_mode=analytic_mode), 2, 2),
+              ('Hand_4dof', lambda analytic_mode: Hand_4dof(device, 8, True, 5, 20, 0.3, analytic_mode=analytic_mode), 8, 8)]
+
+    passed = check_discretization()
+    for name, build, state_size, input_size in models:
+        passed &= check_model(name, build, state_size, input_size, torch.float32, TOL_FLOAT32)
+        passed &= check_model(name, build, state_size, input_size, torch.float64, TOL_FLOAT64)
+    for name, build, state_size, input_size in models:
+        for batch_size in (1, 1024):
+            time_model(name, build, state_size, input_size, batch_size)
+
+    print('PASSED' if passed else 'FAILED')
+    if not passed:
+        raise SystemExit(1)
@@ -18,7 +18,7 @@ from Dynamics2.Joint_1dof_Bilinear_NN import Joint_1dof
 
 class Hand_1dof(nn.Module):
     def __init__(self, device, EMG_Channel_Count, Left, Dyanmic_Lr, EMG_mat_Lr, NN_ratio, \
-                 K0_scale=2000, K1_scale=40000, L0_scale=0.03, L1_scale=0.006, I_scale=0.008, M_scale=0.05, speed_mode=False):
+                 K0_scale=2000, K1_scale=40000, L0_scale=0.03, L1_scale=0.006, I_scale=0.008, M_scale=0.05, speed_mode=False, analytic_mode=False, grouped_nn=False):
         super().__init__()
         
         self.device = device
@@ -41,18 +41,20 @@ class Hand_1dof(nn.Module):
         # Joint
         self.Joint = Joint_1dof(self.device, self.muscles, inertias = self.I, Lr_scale = Dyanmic_Lr, NN_ratio=NN_ratio, \
                                 K0_scale = K0_scale, K1_scale = K1_scale, L0_scale =  L0_scale, \
-                                L1_scale = L1_scale, I_scale = I_scale, M_scale = M_scale, speed_mode = speed_mode)
+                                L1_scale = L1_scale, I_scale = I_scale, M_scale = M_scale, speed_mode = speed_mode, analytic_mode = analytic_mode, grouped_nn = grouped_nn)
         
         # EMG to Muscle activation matrix
         # There will be two initialization style of the EMG to muscle activation matrix.
         # If the electrodes are right upon the targeted muscle eye matrix should be chose, otherwise all-one matrix should be the way to go 
         # I'm using the scaled all-one matrix implementation here.
         # self.EMG_to_Activation_Mat = nn.Parameter(torch.ones((self.muscle_num, self.EMG_Channel_Count), dtype=torch.float, device=self.device)/self.EMG_mat_Lr/self.EMG_Channel_Count)
+        self.frozen_EMG_mat = None # Scaled EMG to muscle activation matrix while frozen
         self.EMG_to_Activation_Mat = nn.Parameter(torch.eye(self.muscle_num, self.EMG_Channel_Count, dtype=torch.float, device=self.device)/self.EMG_mat_Lr)
         
     def forward(self, SS, EMG, dt):
         # Get the muscle activations then pass them into the joint model.
-        Alphas = torch.matmul(EMG, self.EMG_to_Activation_Mat*self.EMG_mat_Lr)
+        EMG_mat = self.EMG_to_Activation_Mat*self.EMG_mat_Lr if self.frozen_EMG_mat is None else self.frozen_EMG_mat
+        Alphas = torch.matmul(EMG, EMG_mat)
         # TODO: #3 Add nonlinear calculation to EMG
         # print(Alphas)
         return self.Joint(SS, Alphas, dt)
@@ -73,6 +75,16 @@ class Hand_1dof(nn.Module):
     def enable_NN(self):
         self.Joint.enable_NN()
         
+    def freeze(self):
+        # Inference mode, see Joint_1dof.freeze
+        with torch.no_grad():
+            self.frozen_EMG_mat = self.EMG_to_Activation_Mat*self.EMG_mat_Lr
+        self.Joint.freeze()
+        
+    def unfreeze(self):
+        self.frozen_EMG_mat = None
+        self.Joint.unfreeze()
+        
     def print_params(self):
         # print all parameters of the dynamic model
         self.Joint.print_params()
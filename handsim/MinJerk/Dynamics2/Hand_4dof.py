@@ -10,7 +10,7 @@ from torch import nn
 from torch.functional import F
 
 from Dynamics2.Muscle import Muscle
-from Dynamics2.Joint_1dof_Bilinear_NN import Joint_1dof
+from Dynamics2.Joint_1dof_Bilinear_NN import Joint_1dof, Joint_1dof_Group
 
 # For Testing
 # from Muscle import Muscle
@@ -18,7 +18,7 @@ from Dynamics2.Joint_1dof_Bilinear_NN import Joint_1dof
 
 class Hand_4dof(nn.Module):
     def __init__(self, device, EMG_Channel_Count, Left, Dyanmic_Lr, EMG_mat_Lr, NN_ratio, \
-                 K0_scale=2000, K1_scale=40000, L0_scale=0.03, L1_scale=0.006, I_scale=0.008, M_scale=0.05, speed_mode=False):
+                 K0_scale=2000, K1_scale=40000, L0_scale=0.03, L1_scale=0.006, I_scale=0.008, M_scale=0.05, speed_mode=False, analytic_mode=False, fused=False, grouped_nn=False):
         super().__init__()
         
         self.device = device
@@ -55,30 +55,35 @@ class Hand_4dof(nn.Module):
         # Joint
         self.Joint1 = Joint_1dof(self.device, self.AMI1, inertias = self.I, Lr_scale = Dyanmic_Lr, NN_ratio=NN_ratio, \
                                 K0_scale = K0_scale, K1_scale = K1_scale, L0_scale =  L0_scale, \
-                                L1_scale = L1_scale, I_scale = I_scale, M_scale = M_scale, speed_mode = speed_mode)
+                                L1_scale = L1_scale, I_scale = I_scale, M_scale = M_scale, speed_mode = speed_mode, analytic_mode = analytic_mode, grouped_nn = grouped_nn)
         
         self.Joint2 = Joint_1dof(self.device, self.AMI2, inertias = self.I, Lr_scale = Dyanmic_Lr, NN_ratio=NN_ratio, \
                                 K0_scale = K0_scale, K1_scale = K1_scale, L0_scale =  L0_scale, \
-                                L1_scale = L1_scale, I_scale = I_scale, M_scale = M_scale, speed_mode = speed_mode)
+                                L1_scale = L1_scale, I_scale = I_scale, M_scale = M_scale, speed_mode = speed_mode, analytic_mode = analytic_mode, grouped_nn = grouped_nn)
         
         self.Joint3 = Joint_1dof(self.device, self.AMI3, inertias = self.I, Lr_scale = Dyanmic_Lr, NN_ratio=NN_ratio, \
                                 K0_scale = K0_scale, K1_scale = K1_scale, L0_scale =  L0_scale, \
-                                L1_scale = L1_scale, I_scale = I_scale, M_scale = M_scale, speed_mode = speed_mode)
+                                L1_scale = L1_scale, I_scale = I_scale, M_scale = M_scale, speed_mode = speed_mode, analytic_mode = analytic_mode, grouped_nn = grouped_nn)
         
         self.Joint4 = Joint_1dof(self.device, self.AMI4, inertias = self.I, Lr_scale = Dyanmic_Lr, NN_ratio=NN_ratio, \
                                 K0_scale = K0_scale, K1_scale = K1_scale, L0_scale =  L0_scale, \
-                                L1_scale = L1_scale, I_scale = I_scale, M_scale = M_scale, speed_mode = speed_mode)
+                                L1_scale = L1_scale, I_scale = I_scale, M_scale = M_scale, speed_mode = speed_mode, analytic_mode = analytic_mode, grouped_nn = grouped_nn)
+        
+        # Evaluate the four joints as one batched computation (see Joint_1dof_Group), the state_dict stays the same
+        self.joint_group = Joint_1dof_Group([self.Joint1, self.Joint2, self.Joint3, self.Joint4]) if fused else None
         
         # EMG to Muscle activation matrix
         # There will be two initialization style of the EMG to muscle activation matrix.
         # If the electrodes are right upon the targeted muscle eye matrix should be chose, otherwise all-one matrix should be the way to go 
         # I'm using the scaled all-one matrix implementation here.
         # self.EMG_to_Activation_Mat = nn.Parameter(torch.ones((self.EMG_Channel_Count, self.muscle_num ), dtype=torch.float, device=self.device)/self.EMG_mat_Lr/self.EMG_Channel_Count)
+        self.frozen_EMG_mat = None # Scaled EMG to muscle activation matrix while frozen
         self.EMG_to_Activation_Mat = nn.Parameter(torch.eye(self.EMG_Channel_Count, self.muscle_num , dtype=torch.float, device=self.device)/self.EMG_mat_Lr)
         
     def forward(self, SS, EMG, dt):
         # Get the muscle activations then pass them into the joint model.
-        Alphas = torch.matmul(EMG[:,0:self.EMG_Channel_Count], self.EMG_to_Activation_Mat*self.EMG_mat_Lr)
+        EMG_mat = self.EMG_to_Activation_Mat*self.EMG_mat_Lr if self.frozen_EMG_mat is None else self.frozen_EMG_mat
+        Alphas = torch.matmul(EMG[:,0:self.EMG_Channel_Count], EMG_mat)
         
         # SS1 = SS[:,0:2]
         # SS2 = SS[:,2:4]
@@ -88,6 +93,9 @@ class Hand_4dof(nn.Module):
         
         # TODO: #3 Add nonlinear calculation to EMG
         # print(Alphas)
+        if self.joint_group is not None:
+            return self.joint_group(SS, Alphas, dt)
+        
         rw1, rs1 = self.Joint1(SS[:, 0:2], Alphas[:, 0:2], dt)
         rw2, rs2 = self.Joint2(SS[:, 2:4], Alphas[:, 2:4], dt)
         rw3, rs3 = self.Joint3(SS[:, 4:6], Alphas[:, 4:6], dt)
@@ -123,6 +131,26 @@ class Hand_4dof(nn.Module):
         self.Joint3.enable_NN()
         self.Joint4.enable_NN()
         
+    def freeze(self):
+        # Inference mode, see Joint_1dof.freeze
+        with torch.no_grad():
+            self.frozen_EMG_mat = self.EMG_to_Activation_Mat*self.EMG_mat_Lr
+        self.Joint1.freeze()
+        self.Joint2.freeze()
+        self.Joint3.freeze()
+        self.Joint4.freeze()
+        if self.joint_group is not None:
+            self.joint_group.freeze()
+        
+    def unfreeze(self):
+        self.frozen_EMG_mat = None
+        self.Joint1.unfreeze()
+        self.Joint2.unfreeze()
+        self.Joint3.unfreeze()
+        self.Joint4.unfreeze()
+        if self.joint_group is not None:
+            self.joint_group.unfreeze()
+        
     def print_params(self):
         # print all parameters of the dynamic model
         self.Joint1.print_params()
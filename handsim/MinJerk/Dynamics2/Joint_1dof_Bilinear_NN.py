@@ -18,14 +18,29 @@ from Dynamics2.Joint import Joint
 class Joint_1dof(Joint):
     def __init__(self, device, muscles, inertias, Lr_scale, NN_ratio, \
                  K0_scale=2000, K1_scale=40000, L0_scale=0.03, L1_scale=0.006, \
-                 I_scale=0.008, M_scale=0.05, speed_mode=False):
+                 I_scale=0.008, M_scale=0.05, speed_mode=False, analytic_mode=False, grouped_nn=False):
         super().__init__(device, muscles, inertias, Lr_scale, \
                          K0_scale, K1_scale, L0_scale, L1_scale, I_scale, M_scale)
         # For the __compensational_nn
         self.compensational_nns = nn.ModuleList([compensational_nn().to(device) for i in range(self.muscle_num)])
         self.speed_mode = speed_mode
+        # Use the closed form of the discretization instead of torch.matrix_exp (accurate simulation only)
+        # Faster for large batches only, not at batch size 1, and equal to matrix_exp up to float32 rounding: see Discretization_Check.py
+        self.analytic_mode = analytic_mode
+        # While frozen, run the compensational networks as one grouped network (see compensational_nn_group).
+        # Faster, but the outputs differ from the per-network nn.Linear calls by float rounding (up to ~3e-7 of the largest state per step)
+        self.grouped_nn = grouped_nn
         self.designed_NN_ratio = NN_ratio
         self.NN_ratio = NN_ratio
+        
+        # Inference mode (see freeze)
+        self.frozen_params = None
+        self.frozen_nn_group = None
+        self.constant_cache = {}
+
+        # Constant patterns of the state space matrices, as buffers so they follow the model between devices (not saved in the state_dict)
+        self.register_buffer('U_unit', torch.tensor([[[1, 0]]], dtype=torch.float, device=self.device), persistent=False)
+        self.register_buffer('eye2', torch.eye(2, dtype=torch.float, device=self.device), persistent=False)
 
     def forward(self, SS, Alphas, dt=0.0166667):
         """Calculate the Joint dynamic for one step
@@ -41,17 +56,11 @@ class Joint_1dof(Joint):
         
         
         # Scale parameters back
-        K0s = [torch.abs(self.K0s[i]*self.K0_scale*self.Lr_scale)
-               for i in range(self.muscle_num)]
-        K1s = [torch.abs(self.K1s[i]*self.K1_scale*self.Lr_scale)
-               for i in range(self.muscle_num)]
-        L0s = [torch.abs(self.L0s[i]*self.L0_scale*self.Lr_scale)
-               for i in range(self.muscle_num)]
-        L1s = [torch.abs(self.L1s[i]*self.L1_scale*self.Lr_scale)
-               for i in range(self.muscle_num)]
-        Ms = [self.Ms[i]*self.M_scale *
-              self.Lr_scale for i in range(self.muscle_num)]
-        I = torch.abs(self.I*self.I_scale*self.Lr_scale)
+        if self.frozen_params is None:
+            K0s, K1s, L0s, L1s, Ms, I = self.scaled_params()
+        else:
+            K0s, K1s, L0s, L1s, Ms, I = self.frozen_params
+        A0, B0, B11, U0, U1, M_zeros, M_lower, M_bottom = self.constants(batch_size, I, SS.device, SS.dtype)
         
         
         #################################
@@ -92,11 +101,9 @@ class Joint_1dof(Joint):
             # Muscle length changing speed
             dl_dt = torch.matmul(dw_dt, moment_arm)[:, 0]
             muscle_SSs.append((l, dl_dt))
-            # Neural Network
-            # Each neural network's output is in the form of [k, l]
-            nn_output = self.compensational_nns[i](l, dl_dt, Alphas[:, i].view(batch_size, 1))*self.NN_ratio
-            # print("nn_output", nn_output)
-            nn_outputs.append(nn_output)
+        # Neural Network
+        # Each neural network's output is in the form of [k, l]
+        nn_outputs = self.nn_outputs(muscle_SSs, Alphas)
         # print("NN_ratio", self.NN_ratio)
         # print("nn outputs:", nn_outputs)
 
@@ -130,10 +137,7 @@ class Joint_1dof(Joint):
         #################
         # For matrix A: A00, A01, A10, A11 are all 2x2 matrix
         # System states are [Wx, Wy, dWx_dt, dWy_dt]
-        # A00 = torch.tensor(np.array([[0,0],[0,0]]*batch_size), dtype=torch.float, device=self.device)
-        A00 = torch.zeros(batch_size, 1, dtype=torch.float, device=self.device)
-        A01 = torch.tensor(np.array([[1]]*batch_size), dtype=torch.float, device=self.device)
-        A0 = torch.hstack([A00, A01])
+        # A0 = [A00, A01] is constant, see constants()
 
         # print("nn_outputs[0][:,0]", nn_outputs[0][:,0].view(batch_size, 1))
         # print("K1s[0]", K1s[0])
@@ -163,8 +167,7 @@ class Joint_1dof(Joint):
         #########################
         #   MATRIX B            #
         #########################
-        B0 = torch.zeros(batch_size, 2, dtype=torch.float,
-                         device=self.device)
+        # B0 is constant, see constants()
         B10 = 0
         for i in range(self.muscle_num):
             # The total force from one muscle (the if the muscle is not stretched)
@@ -173,7 +176,6 @@ class Joint_1dof(Joint):
             # The following K is respect to w(angle)
             B10+= B_F*Ms[i][0]/I[0]
 
-        B11 = torch.tensor([[1/I[0]]] *batch_size, dtype=torch.float, device=self.device)
         B1 = torch.hstack([B10, B11])
         B = torch.stack([B0, B1],1)
         # print("B:", B)
@@ -181,25 +183,22 @@ class Joint_1dof(Joint):
         #########################
         #   U (1,1,Tx,Ty)       #
         #########################
-        U0 = torch.tensor(
-            np.array([[[1, 0]]]*batch_size), dtype=torch.float, device=self.device)
-        U1 = torch.tensor(
-            np.array([[[1, 0]]]*batch_size), dtype=torch.float, device=self.device)
+        # U0 and U1 are constant, see constants()
 
         if(self.speed_mode == False):
             #############################
             #   Accurate Simulation     #
             #############################
-            M = torch.hstack([torch.dstack([A*dt, B*dt, torch.zeros((batch_size, 2, 2), dtype=torch.float, device=self.device)]),
-                              torch.dstack([torch.zeros((batch_size, 2, 4), dtype=torch.float, device=self.device), torch.tensor(
-                                  np.array([np.eye(2)]*batch_size), dtype=torch.float, device=self.device)]),
-                              torch.zeros((batch_size, 2, 6), dtype=torch.float, device=self.device)])
-            # print("M:", M)
+            if self.analytic_mode:
+                Ad, Bd0, Bd1 = self.analytic_discretization(K, I[0], B10, B11, dt, SS.dtype)
+            else:
+                M = torch.hstack([torch.dstack([A*dt, B*dt, M_zeros]), M_lower, M_bottom])
+                # print("M:", M)
 
-            expMT = torch.matrix_exp(M)
-            Ad = expMT[:, :2, :2]
-            Bd1 = expMT[:, :2, 4:]
-            Bd0 = expMT[:, :2, 2:4] - Bd1
+                expMT = torch.matrix_exp(M)
+                Ad = expMT[:, :2, :2]
+                Bd1 = expMT[:, :2, 4:]
+                Bd0 = expMT[:, :2, 2:4] - Bd1
 
             SSout = (torch.bmm(Ad, SS.view(batch_size, 2, 1)) + torch.bmm(Bd0, U0.view(batch_size, 2, 1)) + torch.bmm(Bd1, U1.view(batch_size, 2, 1)))
         else:
@@ -213,6 +212,132 @@ class Joint_1dof(Joint):
         # return SSout.view(batch_size, 4)[:,0:2] + offset , SSout.view(batch_size, 4)
         return SSout.view(batch_size, 2)[:,0:1] , SSout.view(batch_size, 2)
 
+    def nn_outputs(self, muscle_SSs, Alphas):
+        """Outputs of the compensational neural networks times NN_ratio, one [batch_size * 1] per muscle.
+        The networks are skipped when NN_ratio is 0, and run as one grouped network (see compensational_nn_group) while frozen with grouped_nn.
+        """
+        batch_size = len(Alphas)
+        if self.NN_ratio == 0:
+            return [torch.zeros(batch_size, 1, dtype=Alphas.dtype, device=Alphas.device)]*self.muscle_num
+
+        if self.frozen_nn_group is not None:
+            L = torch.stack([l for l, dl_dt in muscle_SSs])
+            dL_dt = torch.stack([dl_dt for l, dl_dt in muscle_SSs])
+            return list(self.frozen_nn_group(L, dL_dt, Alphas.T.unsqueeze(2))*self.NN_ratio)
+
+        return [self.compensational_nns[i](l, dl_dt, Alphas[:, i].view(batch_size, 1))*self.NN_ratio
+                for i, (l, dl_dt) in enumerate(muscle_SSs)]
+
+    @staticmethod
+    def analytic_discretization(K, I, B10, B11, dt, dtype):
+        """Closed form of Ad, Bd0 and Bd1 from the matrix exponential of the accurate simulation.
+        With the critical damping D = 2*sqrt(K*I) used in forward, A = [[0, 1], [-w^2, -2w]] with w = sqrt(K/I) has the
+        repeated eigenvalue -w, so with x = w*h and E = e^(-x)
+            Ad  = E [[1 + x, h], [-w x, 1 - x]]
+        and since the first row of B is zero, only exp(A s) [0, 1] is integrated over the step:
+            Bd0 = [h^2 p2, h (E - p1)] [B10, B11]
+            Bd1 = [h^2 (p1 - p2), h p1] [B10, B11]
+        where pn = integral of t^n e^(-x t) dt from 0 to 1, see exp_moments().
+        """
+        h = dt
+        w = torch.sqrt(K/I)
+        x = w*h
+        E, p1, p2 = Joint_1dof.exp_moments(x.double()).to(dtype).unbind(1)
+        E, p1, p2 = E.view(-1, 1), p1.view(-1, 1), p2.view(-1, 1)
+
+        Ad = (E*torch.hstack([1 + x, torch.full_like(x, h), -w*x, 1 - x])).view(-1, 2, 2)
+        B_row = torch.hstack([B10, B11]).view(-1, 1, 2)
+        Bd0 = torch.hstack([h*h*p2, h*(E - p1)]).view(-1, 2, 1)*B_row
+        Bd1 = torch.hstack([h*h*(p1 - p2), h*p1]).view(-1, 2, 1)*B_row
+        return Ad, Bd0, Bd1
+
+    @staticmethod
+    def exp_moments(x, small=1e-2):
+        """[e^(-x), p1, p2] with pn = integral of t^n e^(-x t) dt from 0 to 1, for x of shape (batch, 1) in float64.
+        The closed forms p1 = (1 - e^(-x)(1 + x))/x^2 and p2 = (2 p1 - e^(-x))/x cancel as x goes to 0,
+        so below small the series pn = sum_k (-x)^k/(k! (n + k + 1)) is used instead (4 terms are exact to ~1e-10 there).
+        """
+        E = torch.exp(-x)
+
+        # Closed form, with x kept away from 0 so the unused branch stays finite
+        xc = torch.clamp(x, min=small)
+        Ec = torch.exp(-xc)
+        p1 = (1 - Ec*(1 + xc))/(xc*xc)
+        p2 = (2*p1 - Ec)/xc
+
+        # Series
+        p1s = ((-x/30 + 1/8)*x - 1/3)*x + 1/2
+        p2s = ((-x/36 + 1/10)*x - 1/4)*x + 1/3
+
+        use_series = x < small
+        return torch.hstack([E, torch.where(use_series, p1s, p1), torch.where(use_series, p2s, p2)])
+
+    def scaled_params(self):
+        # Scale parameters back
+        K0s = [torch.abs(self.K0s[i]*self.K0_scale*self.Lr_scale)
+               for i in range(self.muscle_num)]
+        K1s = [torch.abs(self.K1s[i]*self.K1_scale*self.Lr_scale)
+               for i in range(self.muscle_num)]
+        L0s = [torch.abs(self.L0s[i]*self.L0_scale*self.Lr_scale)
+               for i in range(self.muscle_num)]
+        L1s = [torch.abs(self.L1s[i]*self.L1_scale*self.Lr_scale)
+               for i in range(self.muscle_num)]
+        Ms = [self.Ms[i]*self.M_scale *
+              self.Lr_scale for i in range(self.muscle_num)]
+        I = torch.abs(self.I*self.I_scale*self.Lr_scale)
+        return K0s, K1s, L0s, L1s, Ms, I
+
+    def constants(self, batch_size, I, device, dtype):
+        """The tensors of forward that do not depend on the inputs.
+        They are rebuilt on every call, unless the joint is frozen; then they are cached per (batch_size, device, dtype).
+        """
+        key = (batch_size, device, dtype)
+        if self.frozen_params is not None and key in self.constant_cache:
+            return self.constant_cache[key]
+
+        # Matrix A: [A00, A01]
+        # A00 = torch.tensor(np.array([[0,0],[0,0]]*batch_size), dtype=torch.float, device=self.device)
+        A00 = torch.zeros(batch_size, 1, dtype=dtype, device=device)
+        A01 = torch.ones(batch_size, 1, dtype=dtype, device=device)
+        A0 = torch.hstack([A00, A01])
+
+        # Matrix B: B0 and B11
+        B0 = torch.zeros(batch_size, 2, dtype=dtype,
+                         device=device)
+        B11 = (1/I[0]).detach().to(dtype).expand(batch_size, 1)
+
+        # U (1,1,Tx,Ty)
+        U0 = self.U_unit.to(dtype).expand(batch_size, 1, 2)
+        U1 = self.U_unit.to(dtype).expand(batch_size, 1, 2)
+
+        # Constant blocks of the augmented matrix M of the accurate simulation
+        M_zeros = torch.zeros((batch_size, 2, 2), dtype=dtype, device=device)
+        M_lower = torch.dstack([torch.zeros((batch_size, 2, 4), dtype=dtype, device=device),
+                                self.eye2.to(dtype).expand(batch_size, 2, 2)])
+        M_bottom = torch.zeros((batch_size, 2, 6), dtype=dtype, device=device)
+
+        constants = (A0, B0, B11, U0, U1, M_zeros, M_lower, M_bottom)
+        if self.frozen_params is not None:
+            self.constant_cache[key] = constants
+        return constants
+
+    def freeze(self):
+        """Inference mode: scale the parameters once and cache the constant tensors of forward.
+        The outputs are unchanged (unless grouped_nn), but no gradients flow to the parameters, and changes to them are not seen
+        until unfreeze() is called.
+        """
+        with torch.no_grad():
+            self.frozen_params = self.scaled_params()
+            if self.grouped_nn:
+                self.frozen_nn_group = compensational_nn_group.from_modules(self.compensational_nns)
+        self.constant_cache = {}
+
+    def unfreeze(self):
+        # Back to training mode
+        self.frozen_params = None
+        self.frozen_nn_group = None
+        self.constant_cache = {}
+
     def disalbe_NN(self):
         # Disable the contribution of the neural network
         self.NN_ratio = 0
@@ -243,6 +368,182 @@ class Joint_1dof(Joint):
         print("I:", I)
         
 
+class Joint_1dof_Group():
+    """Several Joint_1dof evaluated together as one batched computation over (batch x joints).
+    The parameters of the joints are stacked along a joint axis and the dynamics of all joints run as one set of tensor ops
+    (one matrix_exp for all of them instead of one per joint), which gives the same results as calling the joints one by one.
+    With grouped_nn, the compensational networks of all joints run as one grouped network while frozen, see Joint_1dof.grouped_nn.
+    This is not an nn.Module: it only reads the parameters of the joints it was made from, so the state_dict of the model
+    that owns the joints is unchanged and gradients still flow to the joints' own parameters.
+    """
+
+    def __init__(self, joints):
+        """
+        Args:
+            joints (list): Joint_1dof with the same number of muscles and the same scale factors
+        """
+        self.joints = list(joints)
+        self.joint_num = len(self.joints)
+        first = self.joints[0]
+        self.muscle_num = first.muscle_num
+        self.scales = (first.K0_scale, first.K1_scale, first.L0_scale, first.L1_scale, first.M_scale, first.I_scale, first.Lr_scale)
+        for joint in self.joints:
+            if joint.muscle_num != self.muscle_num or \
+               (joint.K0_scale, joint.K1_scale, joint.L0_scale, joint.L1_scale, joint.M_scale, joint.I_scale, joint.Lr_scale) != self.scales:
+                raise ValueError("Joint_1dof_Group(): the joints need the same number of muscles and the same scale factors")
+            if joint.speed_mode or joint.analytic_mode != first.analytic_mode or joint.grouped_nn != first.grouped_nn:
+                raise ValueError("Joint_1dof_Group(): the joints need the accurate simulation, all with the same analytic_mode and grouped_nn")
+        self.analytic_mode = first.analytic_mode
+        self.grouped_nn = first.grouped_nn
+
+        # Inference mode (see freeze)
+        self.frozen_params = None
+        self.frozen_nn_group = None
+        self.constant_cache = {}
+
+    def __call__(self, SS, Alphas, dt=0.0166667):
+        return self.forward(SS, Alphas, dt)
+
+    def forward(self, SS, Alphas, dt=0.0166667):
+        """Calculate the dynamics of all joints for one step, the same as calling each Joint_1dof with its slice of the inputs
+        Args:
+            SS (torch.tensor): System states of all joints, [batch_size * (2*joint_number)] as [w, dw] of each joint in order
+            Alphas (torch.tensor): Muscle activations, [batch_size * (muscle_number*joint_number)] in the order of the joints
+            dt (float, optional): Delta t between each iteration. Defaults to 0.0166667.
+        Returns:
+            The joint positions [batch_size * joint_number] and the new system states [batch_size * (2*joint_number)]
+        """
+        batch_size = len(Alphas)
+        J = self.joint_num
+        rows = batch_size*J
+
+        # Parameters as [joint_number * muscle_number], I as [joint_number * 1]
+        if self.frozen_params is None:
+            K0s, K1s, L0s, L1s, Ms, I, raw_Ms = self.scaled_params()
+        else:
+            K0s, K1s, L0s, L1s, Ms, I, raw_Ms = self.frozen_params
+        A0, B0, B11, U0, U1, M_zeros, M_lower, M_bottom = self.constants(batch_size, I, SS.device, SS.dtype)
+
+        # Everything per muscle is [batch_size * joint_number * muscle_number]
+        Alphas = torch.clamp(Alphas, 0, 1).view(batch_size, J, self.muscle_num)
+        SS = SS.view(batch_size, J, 2)
+        l = SS[:, :, 0:1]*raw_Ms                    # Muscle length
+        dl_dt = SS[:, :, 1:2]*raw_Ms                # Muscle length changing speed
+        nn_outputs = self.nn_outputs(l, dl_dt, Alphas)
+
+        # Matrix A (see Joint_1dof.forward), one row per (batch, joint)
+        K_muscle = K0s + K1s*Alphas
+        K = torch.sum(K_muscle*Ms*Ms, 2).view(rows, 1)
+        I_rows = I.view(1, J).expand(batch_size, J).reshape(rows, 1)
+        A10 = -K/I_rows
+
+        # Critical damping
+        D = torch.sqrt(K*I_rows)*2
+        A11 = -D/I_rows
+
+        # Matrix B
+        B_F = K_muscle*(L0s + L1s*Alphas) + K1s*L1s*Alphas*Alphas*nn_outputs
+        B10 = torch.sum(B_F*Ms/I.view(1, J, 1), 2).view(rows, 1)
+
+        # Accurate Simulation
+        if self.analytic_mode:
+            Ad, Bd0, Bd1 = Joint_1dof.analytic_discretization(K, I_rows, B10, B11, dt, SS.dtype)
+        else:
+            A = torch.stack([A0, torch.hstack([A10, A11])], 1)
+            B = torch.stack([B0, torch.hstack([B10, B11])], 1)
+            M = torch.hstack([torch.dstack([A*dt, B*dt, M_zeros]), M_lower, M_bottom])
+
+            expMT = torch.matrix_exp(M)
+            Ad = expMT[:, :2, :2]
+            Bd1 = expMT[:, :2, 4:]
+            Bd0 = expMT[:, :2, 2:4] - Bd1
+
+        SSout = torch.bmm(Ad, SS.reshape(rows, 2, 1)) + torch.bmm(Bd0, U0) + torch.bmm(Bd1, U1)
+        SSout = SSout.view(batch_size, 2*J)
+        return SSout[:, 0::2], SSout
+
+    def nn_outputs(self, l, dl_dt, Alphas):
+        """Outputs of the compensational neural networks of all muscles times the NN_ratio of their joint, [batch_size * joint_number * muscle_number]
+        The networks are skipped while every NN_ratio is 0, and run as one grouped network (see compensational_nn_group) while frozen with grouped_nn.
+        """
+        batch_size = len(Alphas)
+        NN_ratios = [joint.NN_ratio for joint in self.joints]
+        if not any(NN_ratios):
+            return torch.zeros_like(Alphas)
+
+        if self.frozen_nn_group is None:
+            outputs = [joint.compensational_nns[i](l[:, j, i:i+1], dl_dt[:, j, i:i+1], Alphas[:, j, i:i+1])*joint.NN_ratio
+                       for j, joint in enumerate(self.joints) for i in range(self.muscle_num)]
+            return torch.hstack(outputs).view(batch_size, self.joint_num, self.muscle_num)
+
+        # The networks are indexed by (joint, muscle), as rows of [networks * batch_size * 1]
+        def by_network(x):
+            return x.permute(1, 2, 0).reshape(-1, batch_size, 1)
+        outputs = self.frozen_nn_group(by_network(l), by_network(dl_dt), by_network(Alphas))
+        outputs = outputs.view(self.joint_num, self.muscle_num, batch_size).permute(2, 0, 1)
+
+        if NN_ratios.count(NN_ratios[0]) == self.joint_num:
+            return outputs*NN_ratios[0]
+        return outputs*torch.tensor(NN_ratios, dtype=outputs.dtype, device=outputs.device).view(1, self.joint_num, 1)
+
+    def scaled_params(self):
+        # The scaled parameters of all joints (see Joint_1dof.scaled_params) stacked along the joint axis, and the unscaled moment arms
+        K0_scale, K1_scale, L0_scale, L1_scale, M_scale, I_scale, Lr_scale = self.scales
+        J, m = self.joint_num, self.muscle_num
+        def stack(name):
+            return torch.stack([p for joint in self.joints for p in getattr(joint, name)]).view(J, m)
+
+        K0s = torch.abs(stack('K0s')*K0_scale*Lr_scale)
+        K1s = torch.abs(stack('K1s')*K1_scale*Lr_scale)
+        L0s = torch.abs(stack('L0s')*L0_scale*Lr_scale)
+        L1s = torch.abs(stack('L1s')*L1_scale*Lr_scale)
+        raw_Ms = stack('Ms')
+        Ms = raw_Ms*M_scale*Lr_scale
+        I = torch.abs(torch.stack([joint.I for joint in self.joints]).view(J, 1)*I_scale*Lr_scale)
+        return K0s, K1s, L0s, L1s, Ms, I, raw_Ms
+
+    def constants(self, batch_size, I, device, dtype):
+        """The tensors of forward that do not depend on the inputs, with one row per (batch, joint).
+        They are rebuilt on every call, unless the group is frozen; then they are cached per (batch_size, device, dtype).
+        """
+        key = (batch_size, device, dtype)
+        if self.frozen_params is not None and key in self.constant_cache:
+            return self.constant_cache[key]
+
+        rows = batch_size*self.joint_num
+        A0 = torch.hstack([torch.zeros(rows, 1, dtype=dtype, device=device), torch.ones(rows, 1, dtype=dtype, device=device)])
+        B0 = torch.zeros(rows, 2, dtype=dtype, device=device)
+        B11 = (1/I).detach().view(1, self.joint_num).expand(batch_size, self.joint_num).reshape(rows, 1).to(dtype)
+
+        # U (1, 0)
+        U0 = torch.tensor([[1], [0]], dtype=dtype, device=device).expand(rows, 2, 1)
+        U1 = U0
+
+        # Constant blocks of the augmented matrix M of the accurate simulation
+        M_zeros = torch.zeros((rows, 2, 2), dtype=dtype, device=device)
+        M_lower = torch.dstack([torch.zeros((rows, 2, 4), dtype=dtype, device=device),
+                                torch.eye(2, dtype=dtype, device=device).expand(rows, 2, 2)])
+        M_bottom = torch.zeros((rows, 2, 6), dtype=dtype, device=device)
+
+        constants = (A0, B0, B11, U0, U1, M_zeros, M_lower, M_bottom)
+        if self.frozen_params is not None:
+            self.constant_cache[key] = constants
+        return constants
+
+    def freeze(self):
+        # Inference mode, see Joint_1dof.freeze
+        with torch.no_grad():
+            self.frozen_params = self.scaled_params()
+            if self.grouped_nn:
+                self.frozen_nn_group = compensational_nn_group.from_modules([net for joint in self.joints for net in joint.compensational_nns])
+        self.constant_cache = {}
+
+    def unfreeze(self):
+        self.frozen_params = None
+        self.frozen_nn_group = None
+        self.constant_cache = {}
+
+
 class compensational_nn(nn.Module):
     """ This class is the fully connected neural network to compensate the stiffness generated from the
         bilinary model.
@@ -303,6 +604,68 @@ class compensational_nn(nn.Module):
         return output
 
 
+class compensational_nn_group():
+    """ Several compensational_nn evaluated as one network: the weights of each layer are stacked into
+        [networks * in * out] tensors, so every layer of all networks is a single torch.baddbmm.
+        It is not an nn.Module, so it never shows up in a state_dict. Make it from the networks of a model
+        (from_modules) or straight from a checkpoint (from_state_dict).
+        baddbmm sums in a different order than nn.Linear, so the outputs match compensational_nn up to float rounding, not bit for bit.
+    """
+    layers = ['fc1', 'fc2', 'fc3', 'fc4']
+
+    def __init__(self, weights, biases):
+        """
+        Args:
+            weights (list): For each layer, the stacked weights [networks * in * out] (the transposed nn.Linear weights)
+            biases (list): For each layer, the stacked biases [networks * 1 * out]
+        """
+        self.weights = weights
+        self.biases = biases
+        self.network_num = len(weights[0])
+
+    @classmethod
+    def from_modules(cls, nns):
+        """ Stack the parameters of compensational_nn modules. Gradients flow back to the modules, unless this is done under torch.no_grad().
+        Args:
+            nns (list): compensational_nn modules, in the order their inputs and outputs are stacked
+        """
+        weights = [torch.stack([getattr(net, layer).weight for net in nns]).transpose(1, 2).contiguous() for layer in cls.layers]
+        biases = [torch.stack([getattr(net, layer).bias for net in nns]).unsqueeze(1) for layer in cls.layers]
+        return cls(weights, biases)
+
+    @classmethod
+    def from_state_dict(cls, state_dict, prefixes=None, device=None):
+        """ Stack the parameters of compensational_nn saved in a state_dict, e.g. checkpoint['model_state_dict'] of a Hand_4dof.
+        Args:
+            prefixes (list, optional): Key prefixes of the networks, e.g. ['Joint1.compensational_nns.0.', ...].
+                                       Defaults to every compensational_nns in state_dict, in the order they were saved.
+        """
+        if prefixes is None:
+            prefixes = cls.state_dict_prefixes(state_dict)
+        weights = [torch.stack([state_dict[prefix + layer + '.weight'] for prefix in prefixes]).transpose(1, 2).contiguous().to(device)
+                   for layer in cls.layers]
+        biases = [torch.stack([state_dict[prefix + layer + '.bias'] for prefix in prefixes]).unsqueeze(1).to(device)
+                  for layer in cls.layers]
+        return cls(weights, biases)
+
+    @staticmethod
+    def state_dict_prefixes(state_dict):
+        # Key prefixes of all compensational_nn in state_dict, in the order of the keys
+        return [key[:-len('fc1.weight')] for key in state_dict if 'compensational_nns.' in key and key.endswith('.fc1.weight')]
+
+    def __call__(self, L, dL_dt, a):
+        """ Same as compensational_nn.forward, for each network
+        Args:
+            L, dL_dt, a: [networks * batch_size * 1], the inputs of each network
+        Returns:
+            [networks * batch_size * 1]
+        """
+        x = torch.cat([L, dL_dt, a], 2)
+        for W, b in zip(self.weights[:-1], self.biases[:-1]):
+            x = F.leaky_relu(torch.baddbmm(b, x, W))
+        return torch.tanh(torch.baddbmm(self.biases[-1], x, self.weights[-1]))
+
+
 # Test
 """
 device = torch.device("cpu")
@@ -28,6 +28,11 @@ class Joint_2dof(Joint):
         self.compensational_nns = nn.ModuleList(
             [compensational_nn(device=self.device) for i in range(self.muscle_num)])
         self.speed_mode = speed_mode
+        # Constant patterns of the state space matrices, as buffers so they follow the model between devices (not saved in the state_dict)
+        self.register_buffer('U_unit', torch.tensor([[[1, 1, 0, 0]]], dtype=torch.float, device=self.device), persistent=False)
+        self.register_buffer('eye2', torch.eye(2, dtype=torch.float, device=self.device), persistent=False)
+        self.register_buffer('eye4', torch.eye(4, dtype=torch.float, device=self.device), persistent=False)
+        self.register_buffer('nn_output_scale', torch.tensor([self.K1_scale, self.L1_scale], dtype=torch.float, device=self.device), persistent=False)
         self.NN_ratio = NN_ratio
 
     def forward(self, SS, Alphas, dt=0.0166667):
@@ -99,7 +104,7 @@ class Joint_2dof(Joint):
             # Each neural network's output is in the form of [k, l]
             nn_output = self.compensational_nns[i](l, dl_dt, Alphas[:, i].view(batch_size, 1))*self.NN_ratio
             # Scale nn_output by model scale factor
-            nn_output = nn_output * torch.tensor(np.array([self.K1_scale, self.L1_scale]), dtype=torch.float, device=self.device)
+            nn_output = nn_output * self.nn_output_scale
             # print("nn_output", nn_output)
             nn_outputs.append(nn_output)
         # print("NN_ratio", self.NN_ratio)
@@ -138,8 +143,7 @@ class Joint_2dof(Joint):
         # A00 = torch.tensor(np.array([[0,0],[0,0]]*batch_size), dtype=torch.float, device=self.device)
         A00 = torch.zeros(batch_size, 2, 2,
                           dtype=torch.float, device=self.device)
-        A01 = torch.tensor(
-            np.array([np.eye(2)]*batch_size), dtype=torch.float, device=self.device)
+        A01 = self.eye2.expand(batch_size, 2, 2)
         A0 = torch.dstack([A00, A01])
         K_00 = 0
         K_01 = 0
@@ -198,8 +202,7 @@ class Joint_2dof(Joint):
         B10_1 = torch.hstack(
             [torch.zeros(batch_size, 1, device=self.device), B10_11/I[1]])
         B10 = torch.stack([B10_0, B10_1], 1)
-        B11 = torch.tensor([[[1/I[0], 0], [0, 1/I[1]]]] *
-                           batch_size, dtype=torch.float, device=self.device)
+        B11 = torch.diag(1/I).detach().expand(batch_size, 2, 2)
         B1 = torch.dstack([B10, B11])
         B = torch.hstack([B0, B1])
         # print("B:", B)
@@ -207,18 +210,15 @@ class Joint_2dof(Joint):
         #########################
         #   U (1,1,Tx,Ty)       #
         #########################
-        U0 = torch.tensor(
-            np.array([[[1, 1, 0, 0]]]*batch_size), dtype=torch.float, device=self.device)
-        U1 = torch.tensor(
-            np.array([[[1, 1, 0, 0]]]*batch_size), dtype=torch.float, device=self.device)
+        U0 = self.U_unit.expand(batch_size, 1, 4)
+        U1 = self.U_unit.expand(batch_size, 1, 4)
 
         if(self.speed_mode == False):
             #############################
             #   Accurate Simulation     #
             #############################
             M = torch.hstack([torch.dstack([A*dt, B*dt, torch.zeros((batch_size, 4, 4), dtype=torch.float, device=self.device)]),
-                              torch.dstack([torch.zeros((batch_size, 4, 8), dtype=torch.float, device=self.device), torch.tensor(
-                                  np.array([np.eye(4)]*batch_size), dtype=torch.float, device=self.device)]),
+                              torch.dstack([torch.zeros((batch_size, 4, 8), dtype=torch.float, device=self.device), self.eye4.expand(batch_size, 4, 4)]),
                               torch.zeros((batch_size, 4, 12), dtype=torch.float, device=self.device)])
             # print("M:", M)
 
@@ -0,0 +1,81 @@
+"""
+Export the dynamic models to TorchScript for real time inference
+A model (Joint_1dof, Joint_2dof, Hand_1dof, Hand_4dof, Ankle_2dof, ...) is traced for one step with dt fixed, then frozen:
+the parameters are folded into the graph as constants, so one step runs without the Python code of the model.
+The traced graph is for the settings of the model when it was exported (NN_ratio, fused, analytic_mode, grouped_nn, ...) and for the batch size
+of the example inputs. The settings it was exported with are saved in the file next to the graph.
+Export on the device that will run the model.
+"""
+
+import json
+import torch
+from torch import nn
+
+METADATA_FILE = 'metadata.json'
+
+
+class Fixed_dt_Model(nn.Module):
+    """The model with dt fixed, so one step only takes the system states and the inputs (EMG or muscle activations)"""
+
+    def __init__(self, model, dt):
+        super().__init__()
+        self.model = model
+        self.dt = dt
+
+    def forward(self, SS, inputs):
+        return self.model(SS, inputs, self.dt)
+
+
+def export_model(model, path, dt, SS, inputs, metadata=None):
+    """Trace one step of model with dt fixed and save it as a frozen TorchScript module
+    Args:
+        model (nn.Module): The model, with its state_dict loaded. It is put in eval mode (and frozen, if it has freeze()).
+        path (str): File to save
+        dt (float): Delta t between each iteration
+        SS (torch.tensor): Example system states, [batch_size * state_size]
+        inputs (torch.tensor): Example inputs, [batch_size * input_size]
+        metadata (dict, optional): Anything else JSON serializable to save with the model
+    Returns:
+        The frozen module and the metadata saved with it (num_outputs: how many tensors one step returns)
+    """
+    model.eval()
+    if hasattr(model, 'freeze'):
+        model.freeze()
+
+    with torch.no_grad():
+        # One step first, so a frozen model has its constant tensors cached and the trace sees the same graph on every call
+        outputs = model(SS, inputs, dt)
+        traced = torch.jit.trace(Fixed_dt_Model(model, dt).eval(), (SS, inputs))
+    frozen = torch.jit.freeze(traced)
+
+    numStates = getattr(model, 'numStates', 2)  # states of each degree of freedom, [w, dw] by default
+    info = {'model': type(model).__name__, 'dt': dt, 'batch_size': SS.shape[0], 'state_size': SS.shape[1],
+            'input_size': inputs.shape[1], 'numStates': numStates, 'numDoF': SS.shape[1]//numStates,
+            'num_outputs': len(outputs) if isinstance(outputs, tuple) else 1}
+    if metadata is not None:
+        info.update(metadata)
+
+    torch.jit.save(frozen, path, _extra_files={METADATA_FILE: json.dumps(info)})
+    return frozen, info
+
+
+def load_model(path, device=None):
+    """Load a model saved by export_model
+    Returns:
+        The module, called as module(SS, inputs) without dt, and the metadata saved with it
+    """
+    extra_files = {METADATA_FILE: ''}
+    model = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    return model, json.loads(extra_files[METADATA_FILE])
+
+
+# Test
+"""
+from Dynamics2.Hand_4dof import Hand_4dof
+device = torch.device("cpu")
+model = Hand_4dof(device, 8, True, 5, 20, 0.3, fused=True)
+export_model(model, 'Hand_4dof.pt', 1/60, torch.zeros(1, 8), torch.zeros(1, 8))
+traced, metadata = load_model('Hand_4dof.pt', device)
+print(metadata)
+print(traced(torch.zeros(1, 8), torch.rand(1, 8)))
+"""
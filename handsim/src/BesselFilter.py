@@ -2,35 +2,46 @@
 
 from scipy import signal
 import numpy as np
+import IIRKernels
 
 class BesselFilterArr():
-    # this creates an array of Bessel filters for processing multiple signals
-    def __init__(self, numChannels, order, critFreqs, fs, filtType):
+    # this creates a bank of identical Bessel filters for processing multiple signals
+    # every channel shares one SOS design, and the filter state of all channels is stacked into a single (sections, channels, 2) array
+    # so that a whole (channels, samples) block is filtered with one call to sosfilt along axis=1
+    # if numba is available (accelerated=None picks automatically) the block is filtered by the compiled kernel in IIRKernels instead
+    def __init__(self, numChannels, order, critFreqs, fs, filtType, accelerated=None):
         self.numChannels = numChannels
+        self.accelerated = IIRKernels.accelerated if accelerated is None else accelerated
 
         if filtType not in ['bandstop', 'lowpass', 'highpass']:
             raise ValueError(f'Invalid filter type {filtType} provided.')
 
-        self.filters = {'sos': [], 'zi': []}
-        for _ in range(self.numChannels):
-            filter_sos = signal.bessel(N=order, Wn=critFreqs, btype=filtType, output='sos', fs=fs, analog=False)
-            filter_zi = signal.sosfilt_zi(filter_sos)
+        self.sos = signal.bessel(N=order, Wn=critFreqs, btype=filtType, output='sos', fs=fs, analog=False)
+        self.numSections = self.sos.shape[0]
 
-            self.filters['sos'].append(filter_sos)
-            self.filters['zi'].append(filter_zi)
+        # same initial state for every channel, stacked along axis 1
+        self.zi = np.repeat(signal.sosfilt_zi(self.sos)[:, None, :], self.numChannels, axis=1)
 
+    def filter(self, sig, out=None):
+        # sig is [numChannels x numSamples], filtered along the sample axis
+        # if out is given the result is written there (it may be sig itself) instead of being returned as a new array
+        if self.accelerated:
+            if out is None:
+                out = np.empty(np.shape(sig))
 
-    def filter(self, sig):
-        filterOut = np.zeros_like(sig)
+            IIRKernels.sosfiltKernel(self.sos, np.asarray(sig, dtype=float), self.zi, out)
+            return out
 
-        for i in range(self.numChannels):
-            out, self.filters['zi'][i] = signal.sosfilt(self.filters['sos'][i], sig[i, :], zi=self.filters['zi'][i])
-            filterOut[i, :] = out
+        filterOut, self.zi = signal.sosfilt(self.sos, sig, axis=1, zi=self.zi)
+
+        if out is None:
+            return filterOut
 
-        return filterOut
+        out[...] = filterOut
+        return out
 
     def getFilter(self, channelNum):
-        return self.filters['sos'][channelNum], self.filters['zi'][channelNum]
+        return self.sos, self.zi[:, channelNum, :]
 
     def printFilters(self):
         for i in range(self.numChannels):
@@ -3,15 +3,81 @@
 # reference here: http://www.exstrom.com/journal/sigproc/
 #                 http://www.exstrom.com/journal/sigproc/bwbpf.c
 import math
+import numpy as np
+import IIRKernels
 
 class CausalButterArr():
     # this creates an array of casual butterworth filters for processing multiple signals
-    def __init__(self, numChannels, order, f_low, f_high, fs, bandstop=0):
+    # the coefficients and state of every channel are stored as [numChannels x n] arrays (n = order/4 sections) so that all channels are advanced in one vectorized step
+    # if numba is available (accelerated=None picks automatically) the recursion runs in the compiled kernel in IIRKernels instead
+    def __init__(self, numChannels, order, f_low, f_high, fs, bandstop=0, accelerated=None):
         self.numChannels = numChannels
+        self.accelerated = IIRKernels.accelerated if accelerated is None else accelerated
+        self.order = order
+        self.bandstop = bandstop
+
+        # design each channel with the scalar code so the coefficients are exactly those of CausalButter
+        designs = [CausalButter(order, f_low[i], f_high[i], fs, bandstop) for i in range(self.numChannels)]
+        self.n = designs[0].n
+
+        self.A = np.array([d.A for d in designs])
+        self.d1 = np.array([d.d1 for d in designs])
+        self.d2 = np.array([d.d2 for d in designs])
+        self.d3 = np.array([d.d3 for d in designs])
+        self.d4 = np.array([d.d4 for d in designs])
+        if self.bandstop:
+            self.r = np.array([d.r for d in designs])
+            self.s = np.array([d.s for d in designs])
+        else:
+            # unused by the bandpass recursion
+            self.r = np.zeros(self.numChannels)
+            self.s = np.zeros(self.numChannels)
+
+        self.w0 = np.zeros((self.numChannels, self.n))
+        self.w1 = np.zeros((self.numChannels, self.n))
+        self.w2 = np.zeros((self.numChannels, self.n))
+        self.w3 = np.zeros((self.numChannels, self.n))
+        self.w4 = np.zeros((self.numChannels, self.n))
+
+    def inputData(self, raw_data):
+        # raw_data is either one sample per channel [numChannels] or a block [numChannels x npts]; the output has the same shape
+        # same recursion as CausalButter.inputData, applied to every channel at once
+        x = np.asarray(raw_data, dtype=float)
+        singleSample = x.ndim == 1
+        if singleSample:
+            x = x[:, None]
+
+        npts = x.shape[1]
+        filtered_data = np.empty((self.numChannels, npts))
+
+        if self.accelerated:
+            IIRKernels.causalButterKernel(self.A, self.d1, self.d2, self.d3, self.d4, self.r, self.s, bool(self.bandstop),
+                                          self.w0, self.w1, self.w2, self.w3, self.w4, x, filtered_data)
+            return filtered_data[:, 0] if singleSample else filtered_data
+
+        for pnt in range(npts):
+            y = x[:, pnt]
+            for i in range(self.n):
+                w1 = self.w1[:, i]
+                w2 = self.w2[:, i]
+                w3 = self.w3[:, i]
+                w4 = self.w4[:, i]
+
+                w0 = self.d1[:, i]*w1 + self.d2[:, i]*w2 + self.d3[:, i]*w3 + self.d4[:, i]*w4 + y
+                if not self.bandstop:
+                    y = self.A[:, i]*(w0 - 2.0*w2 + w4)
+                else:
+                    # bandstop method changed some coefficients here
+                    y = self.A[:, i]*(w0 - self.r*w1 + self.s*w2 - self.r*w3 + w4)
+
+                self.w4[:, i] = w3
+                self.w3[:, i] = w2
+                self.w2[:, i] = w1
+                self.w1[:, i] = w0
+                self.w0[:, i] = w0
+            filtered_data[:, pnt] = y
 
-        self.filters = []
-        for i in range(self.numChannels):
-            self.filters.append(CausalButter(order, f_low[i], f_high[i], fs, bandstop))
+        return filtered_data[:, 0] if singleSample else filtered_data
     
 class CausalButter:
     # the default init method assumes Causal butter is a bandpass filter, and allows signal frequency from f_low to f_high to pass.
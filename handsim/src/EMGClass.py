@@ -10,14 +10,22 @@ from scipy import signal
 import pandas as pd
 from CausalButter import CausalButterArr
 from BesselFilter import BesselFilterArr
+from EMGPreprocessor import EMGPreprocessor
+from FrameRing import FrameRing
+from LatencyStats import stageStats
 import time
 import threading
 
+# wire format of one EMG packet from the board (previously struct format "ffffffffffffffffffIIIIf")
+emgPacketDtype = np.dtype([('OS_time', 'f4'), ('OS_tick', 'f4'), ('rawEMG', 'f4', (16,)),
+                           ('trigger', 'u4'), ('switch1', 'u4'), ('switch2', 'u4'), ('end', 'u4'), ('samplingFreq', 'f4')])
+
 class EMG():
-    def __init__(self, socketAddr='tcp://127.0.0.1:1235', numElectrodes=16, tauA=0.05, tauD=0.1, usedChannels=None):
+    def __init__(self, socketAddr='tcp://127.0.0.1:1235', numElectrodes=16, tauA=0.05, tauD=0.1, usedChannels=None, drainPackets=False):
         self.numElectrodes = numElectrodes
         self.tauA = tauA
         self.tauD = tauD
+        self.drainPackets = drainPackets # if True, also process every packet already queued in zmq each cycle so the pipeline catches up after a stall
 
         if usedChannels == None:
             self.usedChannels = []
@@ -49,10 +57,17 @@ class EMG():
         self.numSynergies = self.synergyMat.shape[1]
 
         self.resetEMG()
+
+        # processed frames are published here for the other threads to read
+        # recvTime is the host time.monotonic_ns() at which the newest packet of the frame was unpacked, for tracing latency through the controller
+        self.frames = FrameRing([('OS_time', 1), ('OS_tick', 1), ('recvTime', 1), ('trigger', 1), ('rawEMG', self.numElectrodes), ('iEMG', self.numElectrodes),
+                                 ('normedEMG', self.numElectrodes), ('muscleAct', self.numElectrodes), ('synergies', self.synergyMat.shape[0])])
+
+        # received packets are written straight into this buffer, one row per packet
+        self.allocPackets(1)
         
         # initialize the EMG with the first signal (need the sampling frequency)
         self.readEMG()
-        self.initFilters()
 
         # parameters for calculating iEMG
         self.int_window = .05 # sec - 50 ms integration window
@@ -61,7 +76,15 @@ class EMG():
 
         self.window_len = math.ceil(self.int_window*self.samplingFreq)
         # self.rawHistory = np.zeros((self.numElectrodes, self.window_len))
-        self.rawHistory = np.zeros((self.numElectrodes, self.numPackets)) # switch to processing packets (apply filters only once on a number of packets)
+        # when draining, up to a second of queued packets can be processed as one block
+        self.maxPackets = math.ceil(self.samplingFreq) if self.drainPackets else self.numPackets
+        self.blockSize = self.numPackets # number of samples processed in the last cycle
+        self.samplesProcessed = 0 # total number of samples processed
+
+        self.allocPackets(self.maxPackets)
+        self.rawHistory = self.packets['rawEMG'].T # switch to processing packets (apply filters only once on a number of packets) - this is a view into the packet buffer
+
+        self.initFilters()
 
     def __del__(self):
         try:
@@ -88,9 +111,11 @@ class EMG():
         # # self.lowPassFilters = CausalButterArr(numChannels=self.numElectrodes, order=4, f_low=8, f_high=self.samplingFreq*self.int_window/2, fs=self.samplingFreq*self.int_window, bandstop=1) # smooth the envelope
         # self.lowPassFilters = CausalButterArr(numChannels=self.numElectrodes, order=4, f_low=8, f_high=self.samplingFreq/2, fs=self.samplingFreq, bandstop=1) # smooth the envelope, when not using 'actually' integrated EMG
 
-        self.powerLineFilterArray = BesselFilterArr(numChannels=self.numElectrodes, order=8, critFreqs=[58, 62], fs=self.samplingFreq, filtType='bandstop') # remove power line noise and multiples up to 600 Hz
-        self.highPassFilters = BesselFilterArr(numChannels=self.numElectrodes, order=4, critFreqs=20, fs=self.samplingFreq, filtType='highpass') # high pass removes motion artifacts and drift
-        self.lowPassFilters = BesselFilterArr(numChannels=self.numElectrodes, order=4, critFreqs=3, fs=self.samplingFreq, filtType='lowpass') # smooth the envelope, when not using 'actually' integrated EMG
+        # the preprocessor owns the notch, highpass and lowpass Bessel filter banks and runs them on preallocated buffers
+        self.preprocessor = EMGPreprocessor(numChannels=self.numElectrodes, fs=self.samplingFreq, noiseLevel=self.noiseLevel, maxSamples=self.maxPackets)
+        self.powerLineFilterArray = self.preprocessor.powerLineFilters
+        self.highPassFilters = self.preprocessor.highPassFilters
+        self.lowPassFilters = self.preprocessor.lowPassFilters
 
     def startCommunication(self):
         # set the emg thread up here
@@ -183,6 +208,10 @@ class EMG():
            
         return self.synergies[synergy]
 
+    def getBlockSize(self):
+        # number of samples filtered in the last cycle - larger than numPackets while catching up
+        return self.blockSize
+
     def getBounds(self):
         try:
             with open(self.boundsPath, 'rb') as fifo:
@@ -218,20 +247,35 @@ class EMG():
 
     ##########################################################################
     # actual calculations
+    def allocPackets(self, numPackets):
+        # raw bytes of the packets, and a structured view on them so that each field can be read without unpacking
+        self.packetBytes = np.zeros((numPackets, emgPacketDtype.itemsize), dtype=np.uint8)
+        self.packets = self.packetBytes.view(emgPacketDtype)[:, 0]
+
+    def recvPacket(self, slot, flags=0):
+        # receive one packet directly into row slot of the packet buffer
+        nbytes = self.sock.recv_into(self.packetBytes[slot], flags=flags)
+        if nbytes != emgPacketDtype.itemsize:
+            raise ValueError(f'recvPacket(): received {nbytes} bytes, expected an EMG packet of {emgPacketDtype.itemsize} bytes')
+
+    def unpackPacket(self, slot):
+        # copy the header fields of packet slot out of the buffer
+        packet = self.packets[slot]
+
+        self.recvTime = time.monotonic_ns()
+        self.OS_time = float(packet['OS_time'])
+        self.OS_tick = float(packet['OS_tick'])
+        self.rawEMG = packet['rawEMG'].copy()
+        self.trigger = int(packet['trigger'])
+        self.switch1 = int(packet['switch1'])
+        self.switch2 = int(packet['switch2'])
+        self.end = int(packet['end'])
+        self.samplingFreq = float(packet['samplingFreq'])
+
     def readEMG(self):
         try:
-            emgPack = self.sock.recv()
-
-            emg = struct.unpack("ffffffffffffffffffIIIIf", emgPack)
-
-            self.OS_time = emg[0]
-            self.OS_tick = emg[1]
-            self.rawEMG = emg[2:18]
-            self.trigger = emg[18]
-            self.switch1 = emg[19]
-            self.switch2 = emg[20]
-            self.end = emg[21]
-            self.samplingFreq = emg[22]
+            self.recvPacket(0)
+            self.unpackPacket(0)
 
         except OSError as e:
             print(f"readEMG(): Could not read EMG - {e}")
@@ -239,20 +283,28 @@ class EMG():
     # read multiple EMG packets to save time and processing
     def readEMGPacket(self):
         for i in range(self.numPackets):
-            emgPack = self.sock.recv()
+            self.recvPacket(i)
 
-            emg = struct.unpack("ffffffffffffffffffIIIIf", emgPack)
+        # rawHistory is already a view of all the packets - only the latest header is needed
+        self.blockSize = self.numPackets
+        self.unpackPacket(self.blockSize - 1)
 
-            self.OS_time = emg[0]
-            self.OS_tick = emg[1]
-            self.rawEMG = emg[2:18]
-            self.trigger = emg[18]
-            self.switch1 = emg[19]
-            self.switch2 = emg[20]
-            self.end = emg[21]
-            self.samplingFreq = emg[22]
+    # read a group of packets like readEMGPacket, then drain everything else that is already queued
+    def readEMGDrain(self):
+        for i in range(self.numPackets):
+            self.recvPacket(i)
+
+        numRead = self.numPackets
+        while numRead < self.maxPackets:
+            try:
+                self.recvPacket(numRead, flags=zmq.NOBLOCK)
+            except zmq.Again:
+                break # caught up
+
+            numRead += 1
 
-            self.rawHistory[:, i] = emg[2:18]
+        self.blockSize = numRead
+        self.unpackPacket(self.blockSize - 1)
 
     ## The below are all done using numpy, make sure you understand what they do
     # calculate integrated EMG
@@ -285,20 +337,10 @@ class EMG():
 
         # self.iEMG = np.asarray(iEMG)[:, -1]
 
-        emg = np.copy(self.rawHistory)
-        # print(f'emgHistory:\n{emg}\n')
-
-        emg = self.powerLineFilterArray.filter(emg)
-        # print(f'powerLined:\n{emg}\n')
-        emg = np.abs(self.highPassFilters.filter(emg))
-        # print(f'highPass:\n{emg}\n')
-        emg = np.clip(emg - self.noiseLevel[:, None], 0, None)
-        # print(f'noiseGone:\n{emg}\n')
-
-        iEMG = np.clip(self.lowPassFilters.filter(emg), 0, None)
-        # print(f'lowPass:\n{iEMG}\n')
-
-        self.iEMG = np.asarray(iEMG)[:, -1]
+        # notch -> highpass -> rectify -> denoise -> lowpass, all in the preprocessor's work buffers
+        # NOTE: the returned envelope is the preprocessor's buffer, so self.iEMG is overwritten in place every packet block
+        self.iEMG = self.preprocessor.process(self.rawHistory[:, :self.blockSize])
+        self.samplesProcessed += self.blockSize
 
         # print('\n------')
         # print(self.powerLineFilterArray.getFilter(0))
@@ -344,13 +386,36 @@ class EMG():
         self.synergies = self.synergyMat @ self.normedEMG[self.usedChannels]
         return self.synergies
 
+    # publish the results of this cycle as one frame
+    def publishFrame(self):
+        return self.frames.write(OS_time=self.OS_time, OS_tick=self.OS_tick, recvTime=self.recvTime, trigger=self.trigger, rawEMG=self.rawEMG, iEMG=self.iEMG,
+                                 normedEMG=self.normedEMG, muscleAct=self.muscleAct, synergies=self.synergies)
+
+    # one cycle of the EMG update pipeline
+    def stepEMG(self):
+        # self.readEMG()
+        # self.intEMG()
+        # the time of each timed stage goes to stageStats (readEMGPacket includes waiting for the packet)
+        t0 = time.perf_counter_ns()
+        if self.drainPackets:
+            self.readEMGDrain()
+        else:
+            self.readEMGPacket()
+        t1 = time.perf_counter_ns()
+        self.intEMGPacket()
+        t2 = time.perf_counter_ns()
+        self.normEMG()
+        t3 = time.perf_counter_ns()
+        self.synergyProd()
+        t4 = time.perf_counter_ns()
+        self.muscleDynamics()
+        self.publishFrame()
+
+        stageStats.record('readEMGPacket', t1 - t0)
+        stageStats.record('intEMGPacket', t2 - t1)
+        stageStats.record('synergyProd', t4 - t3)
+
     # full EMG update pipeline
     def pipelineEMG(self):
         while self.isRunning:
-            # self.readEMG()
-            # self.intEMG()
-            self.readEMGPacket()
-            self.intEMGPacket()
-            self.normEMG()
-            self.synergyProd()
-            self.muscleDynamics()
+            self.stepEMG()
@@ -0,0 +1,45 @@
+# EMGPreprocessor.py
+# Fused EMG preprocessing stage: notch -> highpass -> rectify -> denoise -> lowpass
+#
+# All intermediate results are written into work buffers that are allocated once, so processing a block of
+# packets does not create new arrays at every step of the chain.
+
+import numpy as np
+from BesselFilter import BesselFilterArr
+
+class EMGPreprocessor():
+    def __init__(self, numChannels, fs, noiseLevel, maxSamples):
+        self.numChannels = numChannels
+        self.fs = fs
+        self.maxSamples = maxSamples # largest block (in samples) that process() will be given
+
+        self.noiseLevel = np.asarray(noiseLevel, dtype=float).reshape(-1, 1) # [numChannels x 1] so it broadcasts over the samples
+
+        self.powerLineFilters = BesselFilterArr(numChannels=self.numChannels, order=8, critFreqs=[58, 62], fs=self.fs, filtType='bandstop') # remove power line noise
+        self.highPassFilters = BesselFilterArr(numChannels=self.numChannels, order=4, critFreqs=20, fs=self.fs, filtType='highpass') # high pass removes motion artifacts and drift
+        self.lowPassFilters = BesselFilterArr(numChannels=self.numChannels, order=4, critFreqs=3, fs=self.fs, filtType='lowpass') # smooth the envelope, when not using 'actually' integrated EMG
+
+        # preallocated work buffers
+        self.work = np.zeros((self.numChannels, self.maxSamples))
+        self.envelope = np.zeros(self.numChannels)
+
+    def process(self, raw):
+        # raw is [numChannels x numSamples] with numSamples <= maxSamples
+        # returns the latest envelope value of each channel - NOTE this is the same buffer every call, copy it if you need to keep it
+        numSamples = raw.shape[1]
+        if numSamples > self.maxSamples:
+            raise ValueError(f'process(): block of {numSamples} samples exceeds the {self.maxSamples} sample buffer')
+
+        emg = self.work[:, :numSamples]
+
+        self.powerLineFilters.filter(raw, out=emg)
+        self.highPassFilters.filter(emg, out=emg)
+        np.abs(emg, out=emg) # rectify
+        np.subtract(emg, self.noiseLevel, out=emg) # remove the noise floor...
+        np.maximum(emg, 0, out=emg) # ...without going negative
+        self.lowPassFilters.filter(emg, out=emg)
+
+        # only the most recent sample of the envelope is used by the controller
+        np.maximum(emg[:, -1], 0, out=self.envelope)
+
+        return self.envelope
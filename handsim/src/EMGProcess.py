@@ -0,0 +1,207 @@
+# EMGProcess.py
+# Run the EMG pipeline in its own process so that the filtering does not share the GIL with the arm threads
+#
+# The child process owns the EMG class (socket, filters, synergies) and publishes every processed frame into a
+# FrameRing that lives in multiprocessing.shared_memory. EMGProcessClient attaches to the same ring and offers the
+# getters of the EMG class, so it can be handed to LUKEArm and LUKEControllers in place of an EMG object.
+#
+# The stage timings of the EMG pipeline (readEMGPacket, intEMGPacket, synergyProd) are recorded in the child's stageStats;
+# EMGProcessClient.fetchStats() asks the child for them over the pipe and merges them into this process's stageStats.
+
+import multiprocessing as mp
+import traceback
+from multiprocessing import shared_memory
+import numpy as np
+from FrameRing import FrameRing
+from LatencyStats import stageStats
+
+def runEMGProcess(emgArgs, conn, startEvent, stopEvent):
+    # entry point of the EMG process
+    from EMGClass import EMG
+
+    emg = EMG(**emgArgs)
+
+    # move the frame ring into shared memory
+    fields, depth = emg.frames.fields, emg.frames.depth
+    shm = shared_memory.SharedMemory(create=True, size=FrameRing.bufferSize(fields, depth))
+    emg.frames = FrameRing(fields, depth, buffer=shm.buf)
+
+    conn.send({'shmName': shm.name, 'fields': fields, 'depth': depth, 'numElectrodes': emg.numElectrodes, 'numSynergies': emg.numSynergies,
+               'samplingFreq': emg.samplingFreq, 'usedChannels': emg.usedChannels})
+
+    try:
+        # wake up for either event, so a client stopped or dropped before startCommunication() does not leave this process waiting forever
+        while not startEvent.wait(0.1) and not stopEvent.is_set():
+            pass
+
+        while not stopEvent.is_set():
+            emg.stepEMG()
+
+            # answer a request from fetchStats() with the stage timings recorded here
+            if conn.poll():
+                conn.recv()
+                conn.send(stageStats.stages)
+
+    except KeyboardInterrupt:
+        pass # the parent decides when to stop
+
+    except Exception:
+        traceback.print_exc() # report it here, the traceback would keep views on the shared memory alive
+
+    conn.close()
+    emg.frames = None # drop the views on the shared memory before closing it
+    shm.close()
+    shm.unlink()
+
+class EMGProcessClient():
+    # same getter API as EMG, backed by the frames the EMG process publishes
+    def __init__(self, **emgArgs):
+        ctx = mp.get_context('spawn') # do not fork the zmq/CAN state of this process
+        self.conn, childConn = ctx.Pipe()
+        self.startEvent = ctx.Event()
+        self.stopEvent = ctx.Event()
+
+        self.process = ctx.Process(target=runEMGProcess, args=(emgArgs, childConn, self.startEvent, self.stopEvent))
+        self.process.daemon = False
+        self.process.start()
+        childConn.close() # so the pipe reports EOF if the EMG process exits
+
+        # blocks until the EMG process has connected to the board
+        try:
+            meta = self.conn.recv()
+        except EOFError:
+            self.process.join()
+            raise RuntimeError(f'EMGProcessClient(): the EMG process exited with code {self.process.exitcode} before connecting to the board (see its traceback above)') from None
+
+        self.numElectrodes = meta['numElectrodes']
+        self.numSynergies = meta['numSynergies']
+        self.samplingFreq = meta['samplingFreq']
+        self.usedChannels = meta['usedChannels']
+
+        self.shm = shared_memory.SharedMemory(name=meta['shmName'])
+        self.frames = FrameRing(meta['fields'], meta['depth'], buffer=self.shm.buf, initialize=False)
+
+    def __del__(self):
+        if not hasattr(self, 'shm'):
+            return # the EMG process never started
+
+        try:
+            self.stopCommunication()
+            self.frames = None
+            self.shm.close()
+        except Exception:
+            print("__del__: Shared memory closing error")
+
+    def startCommunication(self):
+        self.startEvent.set()
+
+    def stopCommunication(self):
+        self.stopEvent.set()
+        self.process.join(timeout=1)
+
+        if self.process.is_alive():
+            # stuck waiting on the board - it cannot clean up after itself, so end it and remove its shared memory here
+            self.process.terminate()
+            self.process.join()
+            self.shm.unlink()
+
+    def fetchStats(self, timeout=1):
+        # copy the stage timings recorded in the EMG process into this process's stageStats - returns False if the process did not answer
+        # (it only answers between EMG packets, so not before startCommunication() or after it has stopped)
+        if not self.process.is_alive():
+            return False
+
+        try:
+            while self.conn.poll(): # a late answer to an earlier request
+                self.conn.recv()
+
+            self.conn.send('stats')
+            if not self.conn.poll(timeout):
+                return False
+            stageStats.stages.update(self.conn.recv())
+        except (EOFError, OSError):
+            return False
+
+        return True
+
+    # setting isRunning = False stops the process, as it does the EMG thread
+    @property
+    def isRunning(self):
+        return self.startEvent.is_set() and not self.stopEvent.is_set()
+
+    @isRunning.setter
+    def isRunning(self, running):
+        if running:
+            self.startCommunication()
+        else:
+            self.stopEvent.set()
+
+    ##########################################################################
+    # get fields
+    def readField(self, name):
+        # copy of one field of the newest frame
+        frame = self.frames.newFrame()
+        self.frames.read(frame)
+        return self.frames.field(frame, name)
+
+    @property
+    def OS_time(self):
+        return self.readField('OS_time')[0]
+
+    @property
+    def trigger(self):
+        return self.readField('trigger')[0]
+
+    @property
+    def rawEMG(self):
+        return self.readField('rawEMG')
+
+    @property
+    def iEMG(self):
+        return self.readField('iEMG')
+
+    @property
+    def normedEMG(self):
+        return self.readField('normedEMG')
+
+    @property
+    def muscleAct(self):
+        return self.readField('muscleAct')
+
+    @property
+    def synergies(self):
+        return self.readField('synergies')
+
+    def getRawEMG(self, electrode):
+        if electrode >= self.numElectrodes:
+            raise ValueError(f'getRawEMG(): Asked for invalid electrode {electrode} of {self.numElectrodes}')
+
+        return self.rawEMG[electrode]
+
+    def getiEMG(self, electrode):
+        if electrode >= self.numElectrodes:
+            raise ValueError(f'getiEMG(): Asked for invalid electrode {electrode} of {self.numElectrodes}')
+
+        return self.iEMG[electrode]
+
+    def getNormedEMG(self, electrode):
+        if electrode >= self.numElectrodes:
+            raise ValueError(f'getNormedEMG(): Asked for invalid electrode {electrode} of {self.numElectrodes}')
+
+        return self.normedEMG[electrode]
+
+    def getFilteredEMG(self, electrode):
+        if electrode >= self.numElectrodes:
+            raise ValueError(f'getFilteredEMG(): Asked for invalid electrode {electrode} of {self.numElectrodes}')
+
+        return self.muscleAct[electrode]
+
+    def getSynergy(self, synergy):
+        if synergy >= self.numSynergies:
+            raise ValueError(f'getSynergy(): Asked for invalid synergy {synergy} of {self.numSynergies}')
+
+        return self.synergies[synergy]
+
+    def synergyProd(self):
+        # the product is computed in the EMG process - return the latest one
+        return self.synergies
@@ -0,0 +1,92 @@
+# FrameRing.py
+# Single-writer/multi-reader ring buffer of preallocated frames
+#
+# A frame is one row of a float array, split into named fields. The writer fills the next slot and only then
+# publishes its sequence number, so readers never need a lock: a reader copies the newest slot and checks that its
+# sequence number did not change during the copy (a seqlock). If the writer lapped the reader mid-copy, it retries.
+
+import numpy as np
+
+class FrameRing():
+    def __init__(self, fields, depth=16, buffer=None, initialize=True):
+        # fields is a list of (name, size) pairs, in the order they are laid out in a frame
+        # if buffer is given (e.g. multiprocessing.shared_memory), the ring lives in it instead of in private memory - it must be at least bufferSize(fields, depth) bytes
+        # only the writer should initialize a shared buffer; readers attaching to it pass initialize=False
+        self.fields = fields
+        self.depth = depth
+
+        self.slices = {}
+        offset = 0
+        for name, size in self.fields:
+            self.slices[name] = slice(offset, offset + size)
+            offset += size
+        self.width = offset
+
+        if buffer is None:
+            buffer = bytearray(self.bufferSize(self.fields, self.depth))
+
+        # layout: [lastSeq | frameSeq x depth | frames x depth], everything 8 bytes wide
+        self.lastSeq = np.frombuffer(buffer, dtype=np.int64, count=1) # sequence number of the newest published frame (-1 before the first)
+        self.frameSeq = np.frombuffer(buffer, dtype=np.int64, count=self.depth, offset=8) # sequence number of the frame in each slot (-1 while it is being written)
+        self.frames = np.frombuffer(buffer, dtype=np.float64, count=self.depth*self.width, offset=8*(1 + self.depth)).reshape(self.depth, self.width)
+
+        if initialize:
+            self.lastSeq[:] = -1
+            self.frameSeq[:] = -1
+            self.frames[:] = 0
+
+    @staticmethod
+    def bufferSize(fields, depth=16):
+        # bytes needed to hold a ring with these fields
+        width = sum(size for _, size in fields)
+        return 8*(1 + depth + depth*width)
+
+    ##########################################################################
+    # writer side - only one thread may write
+    def write(self, **values):
+        seq = int(self.lastSeq[0]) + 1
+        slot = seq % self.depth
+
+        # invalidate the slot before touching it so readers of the old frame in this slot will retry
+        self.frameSeq[slot] = -1
+        frame = self.frames[slot]
+        for name, value in values.items():
+            frame[self.slices[name]] = value
+
+        # publish
+        self.frameSeq[slot] = seq
+        self.lastSeq[0] = seq
+
+        return seq
+
+    ##########################################################################
+    # reader side - any number of threads
+    def newFrame(self):
+        # a buffer for read() to copy into
+        return np.zeros(self.width)
+
+    def read(self, out):
+        # copy the newest frame into out and return its sequence number (-1 if nothing has been written yet)
+        while True:
+            seq = int(self.lastSeq[0])
+            if seq < 0:
+                return seq
+
+            slot = seq % self.depth
+            out[:] = self.frames[slot]
+
+            if self.frameSeq[slot] == seq:
+                return seq
+
+    def latest(self):
+        # the newest frame without copying - it is only valid while isCurrent(seq) is True
+        seq = int(self.lastSeq[0])
+        return seq, self.frames[seq % self.depth]
+
+    def isCurrent(self, seq):
+        # True if frame seq has not been overwritten yet
+        return seq >= 0 and self.frameSeq[seq % self.depth] == seq
+
+    def field(self, frame, name):
+        # view of one named field of a frame
+        return frame[self.slices[name]]
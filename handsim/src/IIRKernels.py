@@ -0,0 +1,56 @@
+# IIRKernels.py
+# Compiled kernels for the per-sample IIR recursions used by BesselFilterArr and CausalButterArr
+#
+# numba is optional. If it can be imported the filter classes dispatch to these kernels automatically, otherwise
+# accelerated is False and they keep using their numpy/scipy code.
+
+try:
+    from numba import njit
+    accelerated = True
+except ImportError:
+    accelerated = False
+
+    def njit(*args, **kwargs):
+        # stand-in decorator so the kernels below still exist (as plain, slow python) without numba
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+@njit(cache=True)
+def sosfiltKernel(sos, x, zi, out):
+    # biquad cascade in transposed direct form II, the same recursion as scipy.signal.sosfilt
+    #   sos is [numSections x 6], x and out are [numChannels x numSamples] (out may be x), zi is [numSections x numChannels x 2] and is updated in place
+    numSections = sos.shape[0]
+    numChannels, numSamples = x.shape
+
+    for c in range(numChannels):
+        for k in range(numSamples):
+            xCur = x[c, k]
+            for s in range(numSections):
+                xNew = sos[s, 0]*xCur + zi[s, c, 0]
+                zi[s, c, 0] = sos[s, 1]*xCur - sos[s, 4]*xNew + zi[s, c, 1]
+                zi[s, c, 1] = sos[s, 2]*xCur - sos[s, 5]*xNew
+                xCur = xNew
+            out[c, k] = xCur
+
+@njit(cache=True)
+def causalButterKernel(A, d1, d2, d3, d4, r, s, bandstop, w0, w1, w2, w3, w4, x, out):
+    # the exstrom.com recursion of CausalButter.inputData, for every channel
+    #   coefficients and state are [numChannels x n], x and out are [numChannels x npts] (out may be x); the state is updated in place
+    numChannels, npts = x.shape
+    n = A.shape[1]
+
+    for c in range(numChannels):
+        for pnt in range(npts):
+            y = x[c, pnt]
+            for i in range(n):
+                w0[c, i] = d1[c, i]*w1[c, i] + d2[c, i]*w2[c, i] + d3[c, i]*w3[c, i] + d4[c, i]*w4[c, i] + y
+                if not bandstop:
+                    y = A[c, i]*(w0[c, i] - 2.0*w2[c, i] + w4[c, i])
+                else:
+                    y = A[c, i]*(w0[c, i] - r[c]*w1[c, i] + s[c]*w2[c, i] - r[c]*w3[c, i] + w4[c, i])
+                w4[c, i] = w3[c, i]
+                w3[c, i] = w2[c, i]
+                w2[c, i] = w1[c, i]
+                w1[c, i] = w0[c, i]
+            out[c, pnt] = y
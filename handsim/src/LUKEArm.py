@@ -5,16 +5,58 @@
 
 import can
 import time
+import struct
+import os
 from can.interface import Bus
 import math
 from EMGClass import EMG
+from EMGProcess import EMGProcessClient
 from controllerClass import LUKEControllers
 import sys
 import zmq
 import numpy as np
 import threading
+from functools import partial
 from CausalButter import CausalButterArr
 from BesselFilter import BesselFilterArr
+from SensorStore import SensorStore
+from RateScheduler import RateScheduler
+from LatencyStats import stageStats
+from SessionLogger import SessionLogger
+
+# precompiled layouts of the sensor messages (positions are big-endian 16 bit counts, forces and statuses are single bytes)
+fourPosStruct = struct.Struct('>4H')
+twoPosStruct = struct.Struct('>2H')
+onePosStruct = struct.Struct('>H')
+fingerForceStruct = struct.Struct('6B') # 5 forces and a status byte
+handForceStruct = struct.Struct('5B') # 4 forces and a status byte
+
+logDir = "/home/haptix/haptix/haptix_controller/handsim/LUKEarmLogs/"
+
+# one row of a recording, written by addLogEntry
+logDtype = np.dtype([('timestamp', 'f8'),
+                     ('jointCommands', 'f8', (8,)),
+                     ('sensorPositions', 'f8', (8,)),
+                     ('sensorForces', 'f8', (13,)),
+                     ('sensorStatus', 'f8', (13,)),
+                     ('command', 'f8', (11,)),
+                     ('rawEMG', 'f8', (16,)),
+                     ('iEMG', 'f8', (16,)),
+                     ('trigger', 'f8')])
+
+# one record per command sent that was computed from EMG: where the command came from and how long it took to get to the arm
+latencyDtype = np.dtype([('sendTime', 'i8'), # host time.monotonic_ns() when the command was sent
+                         ('emgSeq', 'i8'), # sequence number of the EMG frame the command was computed from
+                         ('OS_time', 'f8'), # board timestamp of that frame
+                         ('emgRecvTime', 'i8'), # host time its newest packet was received
+                         ('netTime', 'i8'), # host time the net output using it was ready
+                         ('latency', 'i8')]) # sendTime - emgRecvTime (ns)
+
+# layouts of the fields of the outgoing [ACI1 | ACI2 | ACI3] command, 8 bytes per frame and big-endian 16 bit words
+modeStruct = struct.Struct('>H') # mode select, ACI1 bytes 0-1
+jointsDFStruct = struct.Struct('>8H') # thumbP, thumbY, index, mrp (ACI2), wristRot, wristFlex, humPos, elbow (ACI3)
+armJointsStruct = struct.Struct('>4H') # wristRot, wristFlex, humPos, elbow (ACI3)
+gripStruct = struct.Struct('>2H') # handOC, grip (ACI2)
 
 class LUKEArm:
     def __init__(self, config='HC', hand='L', commandDes='DF', commandType='P', socketAddr="tcp://127.0.0.1:1234", usingEMG=False):       
@@ -67,6 +109,7 @@ class LUKEArm:
             self.sensorIDs = [0x4AA, 0x4BF, 0x1A0, 0x1A4, 0x241, 0x341, 0x4C2]
         else:
             self.sensorIDs = [0x4AA, 0x4BF, 0x241, 0x341, 0x4C2] # the RC sends two less of these sensor IDs
+        self.knownIDs = frozenset(self.sensorIDs + [self.syncID])
         self.messagesReceived = dict.fromkeys(self.sensorIDs + [self.syncID], 0) # for tracking number of messages received
 
         # initial command and sensor settings
@@ -74,11 +117,29 @@ class LUKEArm:
         self.sensorPositions = ['humPos', 'elbowPos', 'wristRot', 'wristFlex', 'thumbYPos', 'thumbPPos', 'indexPos', 'mrpPos']
         self.sensorForces = ['indLatF', 'indTipF', 'midTipF', 'ringTipF', 'pinkTipF', 'palmDistF', 'palmProxF', 'handEdgeF', 'handDorsF', 'thumbUlF', 'thumbRaF', 'thumbTipF', 'thumbDorsF']
         self.sensorStatus = ['indLatStat', 'indTipStat', 'midTipStat', 'ringTipStat', 'pinkTipStat', 'palmDistStat', 'palmProxStat', 'handEdgeStat', 'handDorsStat', 'thumbUlStat', 'thumbRaStat', 'thumbTipStat', 'thumbDorsStat']
-        self.sensors = dict.fromkeys(self.sensorPositions + self.sensorForces + self.sensorStatus, -1)
-
-        self.command = {'modeSelect': 0x000, 'thumbP': 0x000, 'thumbY': 0x000, 'index': 0x000, 'mrp': 0x000,
-                        'handOC': 0x000, 'grip': 0x000,
-                        'wristRot': 0x000, 'wristFlex': 0x000, 'humPos': 0x000, 'elbow': 0x000}
+        self.sensors = SensorStore(self.sensorPositions + self.sensorForces + self.sensorStatus, initial=-1)
+        self.curPosIdx = np.array(self.sensors.indices(['thumbPPos', 'thumbYPos', 'indexPos', 'mrpPos', 'wristRot', 'wristFlex', 'humPos', 'elbowPos'])) # order of getCurPos()
+        self.logPositionIdx = np.array(self.sensors.indices(self.sensorPositions)) # order of the log columns
+        self.logForceIdx = np.array(self.sensors.indices(self.sensorForces))
+        self.logStatusIdx = np.array(self.sensors.indices(self.sensorStatus))
+
+        # decoder for each message identifier, along with the sensor store indices of the fields it fills (status bit i belongs to force i)
+        idx = self.sensors.indices
+        allHandlers = {self.syncID: self.decodeSync,
+                       0x4AA: partial(self.decodePositions, fourPosStruct, 0, idx(['wristRot', 'wristFlex', 'indexPos', 'mrpPos'])),
+                       0x4BF: partial(self.decodePositions, twoPosStruct, 0, idx(['thumbPPos', 'thumbYPos'])),
+                       0x1A0: partial(self.decodePositions, onePosStruct, 4, idx(['humPos'])),
+                       0x1A4: partial(self.decodePositions, onePosStruct, 4, idx(['elbowPos'])),
+                       0x241: partial(self.decodeForces, fingerForceStruct, idx(['indLatF', 'indTipF', 'midTipF', 'ringTipF', 'pinkTipF']), idx(['indLatStat', 'indTipStat', 'midTipStat', 'ringTipStat', 'pinkTipStat'])),
+                       0x341: partial(self.decodeForces, handForceStruct, idx(['palmDistF', 'palmProxF', 'handEdgeF', 'handDorsF']), idx(['palmDistStat', 'palmProxStat', 'handEdgeStat', 'handDorsStat'])),
+                       0x4C2: partial(self.decodeForces, handForceStruct, idx(['thumbUlF', 'thumbRaF', 'thumbTipF', 'thumbDorsF']), idx(['thumbUlStat', 'thumbRaStat', 'thumbTipStat', 'thumbDorsStat']))}
+        self.messageHandlers = {msg_id: allHandlers[msg_id] for msg_id in self.knownIDs}
+
+        self.command = SensorStore(['modeSelect', 'thumbP', 'thumbY', 'index', 'mrp',
+                                    'handOC', 'grip',
+                                    'wristRot', 'wristFlex', 'humPos', 'elbow'], initial=0x000, dtype=np.int64)
+        self.jointCommandIdx = np.array(self.command.indices(['thumbP', 'thumbY', 'index', 'mrp', 'wristRot', 'wristFlex', 'humPos', 'elbow'])) # order of posCom/velCom
+        self.gripCommandIdx = np.array(self.command.indices(['handOC', 'grip']))
 
         # CAN controller settings
         self.ACICountsPerDegree = {'wristRot': 2.90, 'wristFlex': 8.47, 'indexPos': 10.36, 'mrpPos': 10.36, 'thumbPPos': 9.32, 'thumbYPos': 12.43, 'humPos': 5, 'elbowPos': 6.84}
@@ -93,11 +154,35 @@ class LUKEArm:
         else:
             raise ValueError(f"LUKEArm(): invalid handedness {self.hand}")
 
+        # command encoding constants as arrays aligned with posCom: [thumbPPos, thumbYPos, indexPos, mrpPos, wristRot, wristFlex, humPos, elbowPos]
+        self.commandJoints = ['thumbPPos', 'thumbYPos', 'indexPos', 'mrpPos', 'wristRot', 'wristFlex', 'humPos', 'elbowPos']
+        self.jointMin = np.array([self.jointRoM[joint][0] for joint in self.commandJoints], dtype=float)
+        self.jointMax = np.array([self.jointRoM[joint][1] for joint in self.commandJoints], dtype=float)
+        self.countsPerDegree = np.array([self.ACICountsPerDegree[joint] for joint in self.commandJoints])
+        self.zeroCounts = np.array([self.zeroPos[joint] for joint in self.commandJoints], dtype=np.int64)
+        self.maxVel = 0x3FF//2
+
+        # the packed ACI frames sent to the command sender - kept up to date as commands are built, so replying to a sync just sends it
+        self.aciBuffer = bytearray(24)
+
         # for recording
         self.recording = False
+        self.logger = None # streams the log entries to disk while recording
+        self.emgLogFrame = None # buffer for the EMG frame logged with each entry
 
         # neural net control loop rate
         self.Hz = 60
+        self.loopRate = 4 # how much faster the command interpolation in mainControlLoop runs than the neural net
+        self.netScheduler = None # timing of runNetForward, mainControlLoop locks its phase to it (half a control period behind)
+        self.controlScheduler = None
+
+        # EMG-to-command latency tracing: (emgSeq, OS_time, emgRecvTime, netTime) of the latest net output and of the command built from it
+        self.netTrace = None
+        self.commandTrace = None
+        self.netLock = threading.Lock() # NetCom and netTrace are replaced together under it, so a command is tagged with the trace of the net output it came from
+        self.lastRecordedSeq = -1 # emgSeq of the latest latency record - the resends of a command are not recorded again
+        self.latencyLog = np.zeros(2**16, dtype=latencyDtype) # ring of the latest records
+        self.numLatencyRecords = 0
 
         # lowpass filter joint commands
         self.lowpassCommands = CausalButterArr(numChannels=self.numMotors, order=4, f_low=[2, 2, 2, 2, 0.5, 1, 2, 2], f_high=[self.Hz/2]*self.numMotors, fs=self.Hz, bandstop=1)
@@ -135,9 +220,9 @@ class LUKEArm:
         print(f"\t\tThumb yaw: {s['thumbYPos']:8.3f} | thumb pitch: {s['thumbPPos']:8.3f}")
         print(f"\t\tIndex pos: {s['indexPos']:8.3f} |     MRP pos: {s['mrpPos']:8.3f}")
         print("\n\tForce sensors (status):")
-        print(f"\t\t  Index Lat: {s['indLatF']:8.3f} ({s['indLatStat']}) | index tip: {s['indTipF']:8.3f} ({s['indTipStat']}) |   mid tip: {s['midTipF']:8.3f} ({s['midTipStat']}) |   ring tip: {s['ringTipF']:8.3f} ({s['ringTipStat']}) | pinky tip: {s['pinkTipF']:8.3f} ({s['pinkTipStat']})")
-        print(f"\t\t  Palm dist: {s['palmDistF']:8.3f} ({s['palmDistStat']}) | palm prox: {s['palmProxF']:8.3f} ({s['palmProxStat']}) | hand edge: {s['handEdgeF']:8.3f} ({s['handEdgeStat']}) |  hand dors: {s['handDorsF']:8.3f} ({s['handDorsStat']})")
-        print(f"\t\tThumb ulnar: {s['thumbUlF']:8.3f} ({s['thumbUlStat']}) | thumb rad: {s['thumbRaF']:8.3f} ({s['thumbRaStat']}) | thumb tip: {s['thumbTipF']:8.3f} ({s['thumbTipStat']}) | thumb dors: {s['thumbDorsF']:8.3f} ({s['thumbDorsStat']})")
+        print(f"\t\t  Index Lat: {s['indLatF']:8.3f} ({s['indLatStat']:.0f}) | index tip: {s['indTipF']:8.3f} ({s['indTipStat']:.0f}) |   mid tip: {s['midTipF']:8.3f} ({s['midTipStat']:.0f}) |   ring tip: {s['ringTipF']:8.3f} ({s['ringTipStat']:.0f}) | pinky tip: {s['pinkTipF']:8.3f} ({s['pinkTipStat']:.0f})")
+        print(f"\t\t  Palm dist: {s['palmDistF']:8.3f} ({s['palmDistStat']:.0f}) | palm prox: {s['palmProxF']:8.3f} ({s['palmProxStat']:.0f}) | hand edge: {s['handEdgeF']:8.3f} ({s['handEdgeStat']:.0f}) |  hand dors: {s['handDorsF']:8.3f} ({s['handDorsStat']:.0f})")
+        print(f"\t\tThumb ulnar: {s['thumbUlF']:8.3f} ({s['thumbUlStat']:.0f}) | thumb rad: {s['thumbRaF']:8.3f} ({s['thumbRaStat']:.0f}) | thumb tip: {s['thumbTipF']:8.3f} ({s['thumbTipStat']:.0f}) | thumb dors: {s['thumbDorsF']:8.3f} ({s['thumbDorsStat']:.0f})")
         print()
 
     def printCurPos(self):
@@ -162,33 +247,57 @@ class LUKEArm:
         print(f"\tHand OC: {c['handOC']} | Grip: {c['grip']}\n")
 
     ####### LOGGING
-    # set the first row of the recorded data - the title of each column
+    # start a new recording - entries are streamed to a temporary file in logDir until saveRecording() names it
     def resetRecording(self):
-        rawEMGNames = [f'raw{i}' for i in range(16)]
-        iEMGNames = [f'iEMG{i}' for i in range(16)]
-        titles = [['Timestamp'] + self.jointNames + self.sensorPositions + self.sensorForces + self.sensorStatus + list(self.command) + rawEMGNames + iEMGNames + ['Trigger']]
-        self.recordedData = titles
+        if self.logger is not None and not self.logger.closed:
+            self.logger.discard()
+
+        columns = {'timestamp': ['Timestamp'], 'jointCommands': self.jointNames, 'sensorPositions': self.sensorPositions, 'sensorForces': self.sensorForces,
+                   'sensorStatus': self.sensorStatus, 'command': list(self.command), 'rawEMG': [f'raw{i}' for i in range(16)], 'iEMG': [f'iEMG{i}' for i in range(16)],
+                   'trigger': ['Trigger']}
+        path = os.path.join(logDir, f".recording_{time.strftime('%Y%m%d_%H%M%S')}.npy")
+        self.logger = SessionLogger(path, logDtype, columns=columns, metadata={'config': self.config, 'hand': self.hand, 'commandDes': self.commandDes, 'commandType': self.commandType})
+
+    def saveRecording(self, filename=None):
+        # finish the recording and keep it as logDir/filename.npy, or throw it away if filename is None
+        self.recording = False
+        if self.logger is None:
+            return None
+
+        if filename is None:
+            self.logger.discard()
+            path = None
+        else:
+            self.logger.close()
+            path = os.path.join(logDir, filename + '.npy')
+            self.logger.moveTo(path)
+
+        self.logger = None
+        return path
 
     def addLogEntry(self, emg=None):
         # add, in order, the timestamp, the position command, the joint position readings, the force sensor readings, the force sensor statuses, and the hex command sent
-        newEntry = [self.timestamp]
-        newEntry.extend(self.lastposCom)
-        for joint in self.sensorPositions:
-            newEntry.extend([self.sensors[joint]])
-        for sensor in self.sensorForces:
-            newEntry.extend([self.sensors[sensor]])
-        for status in self.sensorStatus:
-            newEntry.extend([self.sensors[status]])
-        for comm in list(self.command):
-            newEntry.extend([self.command[comm]])
-        if emg == None:
-            newEntry.extend([0]*33) # hardcoded 33! 16 channels raw EMG, 16 iEMG, and 1 trigger
+        row = self.logger.nextRow()
+        row['timestamp'] = self.timestamp
+        row['jointCommands'] = self.lastposCom if self.lastposCom is not None else np.nan
+        values = self.sensors.values
+        row['sensorPositions'] = values[self.logPositionIdx]
+        row['sensorForces'] = values[self.logForceIdx]
+        row['sensorStatus'] = values[self.logStatusIdx]
+        row['command'] = self.command.values
+        if emg is None:
+            # 16 channels raw EMG, 16 iEMG, and 1 trigger
+            row['rawEMG'] = 0
+            row['iEMG'] = 0
+            row['trigger'] = 0
         else:
-            newEntry.extend(emg.rawEMG)
-            newEntry.extend(emg.iEMG)
-            newEntry.extend([emg.trigger])
+            # take all the EMG values from one frame so they are consistent with each other
+            if self.emgLogFrame is None: self.emgLogFrame = emg.frames.newFrame()
+            emg.frames.read(self.emgLogFrame)
 
-        self.recordedData.append(newEntry)
+            row['rawEMG'] = emg.frames.field(self.emgLogFrame, 'rawEMG')
+            row['iEMG'] = emg.frames.field(self.emgLogFrame, 'iEMG')
+            row['trigger'] = emg.frames.field(self.emgLogFrame, 'trigger')[0]
  
     ####### COMMAND HELPERS
     def posToCAN(self, pos, joint):
@@ -200,9 +309,22 @@ class LUKEArm:
         canCom = math.floor(self.ACICountsPerDegree[joint]*pos) + self.zeroPos[joint]
         return canCom
 
+    def posToCANArr(self, posCom):
+        # posToCAN for all joints at once, posCom in the order of self.commandJoints
+        pos = np.clip(np.asarray(posCom, dtype=float), self.jointMin, self.jointMax)
+        return np.floor(self.countsPerDegree*pos).astype(np.int64) + self.zeroCounts
+
+    def velToCANArr(self, velCom):
+        # velocities in [-1, 1] (fraction of maximum velocity) for all joints to their CAN commands
+        return np.floor(self.maxVel*np.asarray(velCom, dtype=float)).astype(np.int64) + self.zeroVel
+
     def CANtoPos(self, CAN):
         # convert a 2 byte CAN signal to the corresponding joint position
-        fullCAN = (CAN[0] << 0x8) + CAN[1]
+        return self.countsToPos((CAN[0] << 0x8) + CAN[1])
+
+    @staticmethod
+    def countsToPos(fullCAN):
+        # convert the 16 bit value of a CAN position signal to the joint position
         scaledCAN = fullCAN/2**6
         pos = scaledCAN if scaledCAN <= 180 else (scaledCAN - 1024) # something to handle the negatives (2's complement, essentially)
         return pos
@@ -230,7 +352,9 @@ class LUKEArm:
         # handle arm communication
         while self.isRunning:
             self.recv()
+            t0 = time.perf_counter_ns()
             self.messageCallback()
+            stageStats.record('messageCallback', time.perf_counter_ns() - t0)
 
     def syncAck(self):
         status = self.data[0]
@@ -239,118 +363,96 @@ class LUKEArm:
 
     def messageCallback(self):
         msg_id = self.arbitration_id
-        if msg_id in self.sensorIDs + [self.syncID]:
+        if msg_id in self.knownIDs:
             self.messagesReceived[msg_id] += 1
-            data = list(self.data)
-
-            # sync message
-            if msg_id == self.syncID:
-                self.syncAck()
-                self.sendCommand() # reply to sync message
-
-            # sensor messages
-            elif msg_id == 0x4AA:
-                self.sensors['wristRot'] = self.CANtoPos(data[0:2])
-                self.sensors['wristFlex'] = self.CANtoPos(data[2:4])
-                self.sensors['indexPos'] = self.CANtoPos(data[4:6])
-                self.sensors['mrpPos'] = self.CANtoPos(data[6:8])
-            elif msg_id == 0x4BF:
-                self.sensors['thumbPPos'] = self.CANtoPos(data[0:2])
-                self.sensors['thumbYPos'] = self.CANtoPos(data[2:4])
-            elif msg_id == 0x1A0:
-                self.sensors['humPos'] = self.CANtoPos(data[4:6])
-            elif msg_id == 0x1A4:
-                self.sensors['elbowPos'] = self.CANtoPos(data[4:6])
-            elif msg_id == 0x241:
-                self.sensors['indLatF'] = data[0] / 10
-                self.sensors['indTipF'] = data[1] / 10
-                self.sensors['midTipF'] = data[2] / 10
-                self.sensors['ringTipF'] = data[3] / 10
-                self.sensors['pinkTipF'] = data[4] / 10
-                self.sensors['pinkTipStat'] = (data[5] >> 4) & 1
-                self.sensors['ringTipStat'] = (data[5] >> 3) & 1
-                self.sensors['midTipStat'] = (data[5] >> 2) & 1
-                self.sensors['indTipStat'] = (data[5] >> 1) & 1
-                self.sensors['indLatStat'] = data[5] & 1
-            elif msg_id == 0x341:
-                self.sensors['palmDistF'] = data[0] / 10
-                self.sensors['palmProxF'] = data[1] / 10
-                self.sensors['handEdgeF'] = data[2] / 10
-                self.sensors['handDorsF'] = data[3] / 10
-                self.sensors['handDorsStat'] = (data[4] >> 3) & 1
-                self.sensors['handEdgeStat'] = (data[4] >> 2) & 1
-                self.sensors['palmProxStat'] = (data[4] >> 1) & 1
-                self.sensors['palmDistStat'] = data[4] & 1
-            elif msg_id == 0x4C2:
-                self.sensors['thumbUlF'] = data[0] / 10
-                self.sensors['thumbRaF'] = data[1] / 10
-                self.sensors['thumbTipF'] = data[2] / 10
-                self.sensors['thumbDorsF'] = data[3] / 10
-                self.sensors['thumbDorsStat'] = (data[4] >> 3) & 1
-                self.sensors['thumbTipStat'] = (data[4] >> 2) & 1
-                self.sensors['thumbRaStat'] = (data[4] >> 1) & 1
-                self.sensors['thumbUlStat'] = data[4] & 1
-
-            # Uh-oh - error!
-            else:
-                raise ValueError(f'messageCallback(): Invalid message arbitration_id {msg_id:03X}')
+            self.messageHandlers[msg_id](self.data)
+
+    # message decoders, each unpacks all fields of its message at once
+    def decodeSync(self, data):
+        self.syncAck()
+        t0 = time.perf_counter_ns()
+        self.sendCommand() # reply to sync message
+        stageStats.record('sendCommand', time.perf_counter_ns() - t0)
+
+        if self.commandTrace is not None:
+            self.recordLatency(self.commandTrace)
+
+    def recordLatency(self, trace):
+        # log the command just sent against the EMG frame it came from - only its first send, a resend would only add a longer latency
+        emgSeq, OS_time, emgRecvTime, netTime = trace
+        if emgSeq < 0 or emgSeq == self.lastRecordedSeq:
+            return # no EMG frame yet, or already recorded
+
+        self.lastRecordedSeq = emgSeq
+
+        sendTime = time.monotonic_ns()
+        self.latencyLog[self.numLatencyRecords % len(self.latencyLog)] = (sendTime, emgSeq, OS_time, emgRecvTime, netTime, sendTime - emgRecvTime)
+        self.numLatencyRecords += 1
+        stageStats.record('emgToCommand', sendTime - emgRecvTime)
+
+    def getLatencyLog(self):
+        # the latency records still in the ring, oldest first
+        size = len(self.latencyLog)
+        if self.numLatencyRecords <= size:
+            return self.latencyLog[:self.numLatencyRecords].copy()
+        return np.roll(self.latencyLog, -(self.numLatencyRecords % size))
+
+    def decodePositions(self, layout, offset, indices, data):
+        # joint position message: big-endian 16 bit counts starting at offset
+        values = self.sensors.values
+        for i, counts in zip(indices, layout.unpack_from(data, offset)):
+            values[i] = self.countsToPos(counts)
+        self.sensors.publish(self.timestamp)
+
+    def decodeForces(self, layout, forceIndices, statusIndices, data):
+        # force sensor message: one byte per force (in tenths) followed by a byte of status bits
+        *forces, status = layout.unpack_from(data)
+        values = self.sensors.values
+        for bit, (i, force) in enumerate(zip(forceIndices, forces)):
+            values[i] = force / 10
+            values[statusIndices[bit]] = (status >> bit) & 1
+        self.sensors.publish(self.timestamp)
 
     ###### COMMAND GENERATION
     def isValidCommand(self):
         # returns true if all commands in the list are between 0x000 and 0x3FF (0 to 1023)
-        commandCAN = self.command.values()
-        vals = [(com >= 0x000 and com <= 0x3FF) for com in commandCAN]
-        return all(vals)
+        commandCAN = self.command.values
+        return bool(((commandCAN >= 0x000) & (commandCAN <= 0x3FF)).all())
 
     def isValidPosJoint(self, pos, joint):
         return pos >= self.jointRoM[joint][0] and pos <= self.jointRoM[joint][1]
 
     def isValidPosList(self, posList):
         # returns true if all positions given are in the appropriate joint range
-        joints = ['thumbPPos', 'thumbYPos', 'indexPos', 'mrpPos', 'wristRot', 'wristFlex', 'humPos', 'elbowPos']
-        return all([(posList[i] >= self.jointRoM[joints[i]][0] and posList[i] <= self.jointRoM[joints[i]][1]) for i in range(len(posList))])
+        posArr = np.asarray(posList, dtype=float)
+        numPos = len(posArr)
+        return bool(((posArr >= self.jointMin[:numPos]) & (posArr <= self.jointMax[:numPos])).all())
 
     def getCurPos(self):
-        return [self.sensors['thumbPPos'], self.sensors['thumbYPos'], self.sensors['indexPos'], self.sensors['mrpPos'], self.sensors['wristRot'], self.sensors['wristFlex'], self.sensors['humPos'], self.sensors['elbowPos']]
+        # [thumbPPos, thumbYPos, indexPos, mrpPos, wristRot, wristFlex, humPos, elbowPos], a copy of the current readings
+        return self.sensors.get(self.curPosIdx)
 
     def buildEmptyCommand(self):
-        for i in self.command.keys():
-            self.command[i] = 0x000
+        self.command.values[:] = 0x000
+        self.aciBuffer[:] = bytes(len(self.aciBuffer))
 
     def buildCommand(self, posCom=None, velCom=None, gripCom=None):
-        if posCom != None and velCom == None and gripCom == None:
+        if posCom is not None and velCom is None and gripCom is None:
             # build the position commands here
             # CONTRACT: these positions will all be valid in the RoM for the given joint
-            self.command['thumbP'] = self.posToCAN(posCom[0], 'thumbPPos')
-            self.command['thumbY'] = self.posToCAN(posCom[1], 'thumbYPos')
-            self.command['index'] = self.posToCAN(posCom[2], 'indexPos')
-            self.command['mrp'] = self.posToCAN(posCom[3], 'mrpPos')
-            self.command['wristRot'] = self.posToCAN(posCom[4], 'wristRot')
-            self.command['wristFlex'] = self.posToCAN(posCom[5], 'wristFlex')
-            self.command['humPos'] = self.posToCAN(posCom[6], 'humPos')
-            self.command['elbow'] = self.posToCAN(posCom[7], 'elbowPos')
-
-        elif posCom == None and velCom != None and gripCom == None:
+            self.command.values[self.jointCommandIdx] = self.posToCANArr(posCom)
+
+        elif posCom is None and velCom is not None and gripCom is None:
             # build the velocity commands here
             # CONTRACT: these velocities will be in [-1, 1] representing fraction of maximum velocity in each direction
-            maxVel = 0x3FF//2
-            self.command['thumbP'] =  math.floor(maxVel*velCom[0]) + self.zeroVel
-            self.command['thumbY'] = math.floor(maxVel*velCom[1]) + self.zeroVel
-            self.command['index'] = math.floor(maxVel*velCom[2]) + self.zeroVel
-            self.command['mrp'] = math.floor(maxVel*velCom[3]) + self.zeroVel
-
-            self.command['wristRot'] = math.floor(maxVel*velCom[4]) + self.zeroVel
-            self.command['wristFlex'] = math.floor(maxVel*velCom[5]) + self.zeroVel
-            self.command['humPos'] = math.floor(maxVel*velCom[6]) + self.zeroVel
-            self.command['elbow'] = math.floor(maxVel*velCom[7]) + self.zeroVel
+            self.command.values[self.jointCommandIdx] = self.velToCANArr(velCom)
 
             # self.lastvelCom = velCom
 
-        elif posCom == None and velCom == None and gripCom != None:
+        elif posCom is None and velCom is None and gripCom is not None:
             # build the grip commands here2
             # CONTRACT: TODO
-            self.command['handOC'] = gripCom[0]
-            self.command['grip'] = gripCom[1]
+            self.command.values[self.gripCommandIdx] = gripCom[:2]
 
             # self.lastgripCom = gripCom
 
@@ -360,29 +462,24 @@ class LUKEArm:
         if not self.isValidCommand():
             raise ValueError(f'buildCommand(): invalid command {self.command}')
 
-    def sendCommand(self):
-        if not self.isValidCommand():
-            raise ValueError(f'sendCommand(): invalid command {self.command}')
-
-        c = self.command
-        dACI1 = [c['modeSelect'] >> 0x8, c['modeSelect'] & 0xFF, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-        dACI3 = [c['wristRot'] >> 0x8, c['wristRot'] & 0xFF, c['wristFlex'] >> 0x8, c['wristFlex'] & 0xFF, c['humPos'] >> 0x8, c['humPos'] & 0xFF, c['elbow'] >> 0x8, c['elbow'] & 0xFF]
-
-        if self.commandDes == 'DF':
-            # make the direct finger control commands here
-            dACI2 = [c['thumbP'] >> 0x8, c['thumbP'] & 0xFF, c['thumbY'] >> 0x8, c['thumbY'] & 0xFF, c['index'] >> 0x8, c['index'] & 0xFF, c['mrp'] >> 0x8, c['mrp'] & 0xFF]
-        elif self.commandDes == 'G':
-            # make the grip control commands here
-            dACI2 = [c['handOC'] >> 0x8, c['handOC'] & 0xFF, c['grip'] >> 0x8, c['grip'] & 0xFF, 0x00, 0x00, 0x00, 0x00]
+        # only a valid command makes it into the frames that get sent
+        values = self.command.values
+        if posCom is None and velCom is None:
+            if self.commandDes == 'G':
+                gripStruct.pack_into(self.aciBuffer, 8, *values[self.gripCommandIdx].tolist())
+        elif self.commandDes == 'DF':
+            jointsDFStruct.pack_into(self.aciBuffer, 8, *values[self.jointCommandIdx].tolist())
         else:
-            raise ValueError('sendCommand(): Incorrect command description %s' % self.commandDes)
+            armJointsStruct.pack_into(self.aciBuffer, 16, *values[self.jointCommandIdx[4:]].tolist())
 
-        self.send(dACI1, dACI2, dACI3)
+    def sendCommand(self):
+        # the command was validated and packed when it was built
+        self.send(self.aciBuffer)
 
-    def send(self, dACI1, dACI2, dACI3):
+    def send(self, commsPacked):
         # instead of sending directly, I will pass the commands to the communication process, which will send them
-        commsPacked = bytearray(dACI1 + dACI2 + dACI3)
-        self.sock.send(commsPacked)
+        # NOTE pyzmq still copies messages this small (below zmq.COPY_THRESHOLD) when sending, so the buffer can be changed right after
+        self.sock.send(commsPacked, copy=False)
 
     ####### MODE SWITCHING AND STARTUP
     def initSensors(self):
@@ -440,23 +537,34 @@ class LUKEArm:
         print("In standby mode")
 
     def changeMode(self, modeSend):
+        if not 0x000 <= modeSend <= 0x3FF:
+            raise ValueError(f'changeMode(): invalid mode {modeSend}')
+
         self.modeSend = modeSend
         self.command['modeSelect'] = modeSend # need to set this here, but I'm not happy about it
+        modeStruct.pack_into(self.aciBuffer, 0, modeSend)
 
     def shutdown(self):
         self.longModeSwitch()
 
     ###### CONTROL
+    def timingStats(self):
+        # loop scheduler statistics, and the number of each message received, to save along with the stage timings
+        schedulers = {name: scheduler.stats() for name, scheduler in [('netScheduler', self.netScheduler), ('controlScheduler', self.controlScheduler)] if scheduler is not None}
+        return {'schedulers': schedulers, 'messagesReceived': {f'{msg_id:#05x}': n for msg_id, n in self.messagesReceived.items()}}
+
     def mainControlLoop(self, emg=None, controller=None):
         try:
-            loopRate = 4 # this is how much faster this should run than the neural net
-            count = 0
-            T = time.time()
+            loopRate = self.loopRate # this is how much faster this should run than the neural net
+            # to run this loop at a consistent interval (LOOPRATEx faster than the neural net runs!) - on the same schedule as the net,
+            # half a control period after it, so runNetForward has always moved lastposCom on before count 0 interpolates from it
+            # (on the very same deadline, which thread ran first would decide whether count 0 jumps back to the old lastposCom)
+            epoch = None
+            if self.netScheduler is not None:
+                epoch = self.netScheduler.epoch + round(1e9/(loopRate*self.Hz))//2
+            self.controlScheduler = RateScheduler(loopRate*self.Hz, epoch=epoch, policy='skip')
             while True:
-                # to run this loop at a consistent interval (LOOPRATEx faster than the neural net runs!)
-                newT = time.time()
-                time.sleep(max(1/(loopRate*self.Hz) - (newT - T), 0))
-                T = time.time()
+                count = self.controlScheduler.wait() % loopRate
 
                 if self.usingEMG:
                     # posCom = controller.differentialActCommand(threshold=0.05, gain=1) # differential activation controller
@@ -464,10 +572,13 @@ class LUKEArm:
                     # posCom = controller.PIDcontroller(posCom) # PID to update comands when too far away
                     # posCom = controller.rateLimit(posCom) # pseudo-velocity to update commands when too far away
 
+                    with self.netLock:
+                        netCom, netTrace = self.NetCom, self.netTrace
+
                     posCom = []
                     # interpolate between outputs from the neural net model
                     for i in range(self.numMotors):
-                        posCom.append((self.NetCom[i] - self.lastposCom[i])/loopRate*count + self.lastposCom[i])
+                        posCom.append((netCom[i] - self.lastposCom[i])/loopRate*count + self.lastposCom[i])
 
                 else:
                     thumbP = self.sensors['thumbPPos']
@@ -494,13 +605,13 @@ class LUKEArm:
                 # if count % loopRate == 0: print(f'{time.time():.5f}', [f"{pos:07.3f}" for pos in posCom])
 
                 # posCom = self.getCurPos() # dont move arm
+                t0 = time.perf_counter_ns()
                 self.buildCommand(posCom=posCom)
+                stageStats.record('buildCommand', time.perf_counter_ns() - t0)
+                if self.usingEMG: self.commandTrace = netTrace
                 # self.printSensors()
 
                 if self.recording: self.addLogEntry(emg)
-
-                count += 1
-                count = count % 4
     
         except KeyboardInterrupt:
             print("\nControl ended.")
@@ -510,17 +621,26 @@ class LUKEArm:
 
     # For a thread that runs the neural net at self.Hz, allowing faster command interpolation to be sent to the arm
     def runNetForward(self, controller):
-        T = time.time()
         self.NetCom = self.getCurPos()
         controller.resetModel()
+        self.netScheduler = RateScheduler(self.Hz, policy='skip')
         while(self.isRunning):
-            newT = time.time()
-            time.sleep(max(1/self.Hz - (newT - T), 0))
-            T = time.time()
+            self.netScheduler.wait()
 
             self.lastposCom = self.NetCom
+            t0 = time.perf_counter_ns()
             posCom = controller.forwardDynamics()
-            self.NetCom = [self.lowpassCommands.filters[i].inputData([posCom[i]])[0] for i in range(self.numMotors)]
+            t1 = time.perf_counter_ns()
+            netCom = self.lowpassCommands.inputData(posCom).tolist()
+            t2 = time.perf_counter_ns()
+            netTrace = controller.emgTrace + (time.monotonic_ns(),)
+            with self.netLock:
+                self.NetCom = netCom
+                self.netTrace = netTrace
+
+            stageStats.record('forwardDynamics', t1 - t0)
+            stageStats.record('lowpassCommands', t2 - t1)
+            if netTrace[0] >= 0: stageStats.record('emgToNet', netTrace[3] - netTrace[2])
             # self.NetCom = self.lowpassCommands.filter(posCom)
 
     def goToZeroPos(self, period):
@@ -625,24 +745,28 @@ class LUKEArm:
 ###################################################################
 def callback():
     run = ""
-    while run not in ["standby", "arm", "hand", "startup", "record", "zero", "manual", "box", "exit"]:
-        run = input("\nEnter 'startup' to enable the arm.\nEnter 'standby' to put the arm in standby mode.\nEnter 'arm' to switch to arm mode.\nEnter 'hand' to switch to hand mode.\nEnter 'record' and then a control mode to record the arm's movement.\nEnter 'zero' to return the arm to joint positions of 0.\nEnter 'manual' to enter manual joint positions.\nEnter 'box' to put the arm in storage configuration.\nEnter 'exit' to put the arm in standby mode and quit:\n")
+    while run not in ["standby", "arm", "hand", "startup", "record", "zero", "manual", "box", "stats", "exit"]:
+        run = input("\nEnter 'startup' to enable the arm.\nEnter 'standby' to put the arm in standby mode.\nEnter 'arm' to switch to arm mode.\nEnter 'hand' to switch to hand mode.\nEnter 'record' and then a control mode to record the arm's movement.\nEnter 'zero' to return the arm to joint positions of 0.\nEnter 'manual' to enter manual joint positions.\nEnter 'box' to put the arm in storage configuration.\nEnter 'stats' to save the loop timing statistics.\nEnter 'exit' to put the arm in standby mode and quit:\n")
 
     return run
 
-def main(usingEMG):
+def main(usingEMG, emgProcess=False, exportedModel=None):
     # instantiate arm class
     arm = LUKEArm(config='RC', hand='L', commandDes='DF', commandType='P', socketAddr="tcp://127.0.0.1:1234", usingEMG=usingEMG)
 
     # connect to EMG board
     if usingEMG:
         print("Connecting to EMG board...")
-        emg = EMG(usedChannels=[0, 1, 4, 5, 6, 7, 8, 12, 13, 14])
+        if emgProcess:
+            # run the EMG pipeline in its own process, reading its output from shared memory
+            emg = EMGProcessClient(usedChannels=[0, 1, 4, 5, 6, 7, 8, 12, 13, 14])
+        else:
+            emg = EMG(usedChannels=[0, 1, 4, 5, 6, 7, 8, 12, 13, 14])
         emg.startCommunication()
         print("Connected.")
 
         # setup the controller class
-        controller = LUKEControllers(numMotors=arm.numMotors, freq_n=3, LUKEArm=arm, emg=emg)
+        controller = LUKEControllers(numMotors=arm.numMotors, freq_n=3, LUKEArm=arm, emg=emg, exportedModelPath=exportedModel)
 
         # start the neural net thread
         netThread = threading.Thread(target=arm.runNetForward, args=[controller])
@@ -679,12 +803,10 @@ def main(usingEMG):
 
                 # set recording to false, regardless of whether you have been recording
                 if arm.recording:
-                    filename = input('Enter a .csv filename: ')
-                    if not filename == "exit":
-                        dataToSave = np.array(arm.recordedData)
-                        np.savetxt("/home/haptix/haptix/haptix_controller/handsim/LUKEarmLogs/" + filename + '.csv', dataToSave, delimiter='\t', fmt='%s')
-
                     arm.recording = False
+                    filename = input('Enter a log filename (saved as .npy, convert with SessionLogger.exportCSV): ')
+                    path = arm.saveRecording(filename if not filename == "exit" else None)
+                    if path is not None: print(f"Saved {path}")
 
             elif run == "standby":
                 print("\n\nSwitching to standby mode...")
@@ -692,8 +814,8 @@ def main(usingEMG):
 
             elif run == "record":
                 print("\n\nRecording next arm movement...")
-                arm.recording = True
                 arm.resetRecording()
+                arm.recording = True
 
             elif run == "zero":
                 print("\n\nZeroing joints...")
@@ -707,6 +829,16 @@ def main(usingEMG):
                 print("\n\nGoing to box configuration...")
                 arm.boxConfig()
             
+            elif run == "stats":
+                if usingEMG and hasattr(emg, 'fetchStats'):
+                    if not emg.fetchStats(): print("EMG process did not report its stage timings")
+                stageStats.printSummary()
+                statsFile = os.path.join(logDir, f"stats_{time.strftime('%Y%m%d_%H%M%S')}.json")
+                with open(statsFile, 'w') as f:
+                    f.write(stageStats.toJSON(extra=arm.timingStats(), indent=1))
+                np.save(statsFile.replace('.json', '_latency.npy'), arm.getLatencyLog()) # per-command EMG-to-command latency records
+                print(f"Saved timing statistics to {statsFile}")
+
             elif run == "exit":
                 break
 
@@ -724,11 +856,13 @@ def main(usingEMG):
 
 if __name__ == '__main__':
     usingEMG = False
+    emgProcess = False
+    exportedModel = None
 
     if len(sys.argv) == 1:
         print("Starting LUKEArm.py (no EMG)...\n")
 
-    elif len(sys.argv) == 2:
+    elif len(sys.argv) in [2, 3, 4]:
         try:
             isNum = int(sys.argv[1])
             
@@ -736,7 +870,18 @@ if __name__ == '__main__':
             usingEMG = True
         except Exception as exc:
             raise ValueError(f"Wrong argument type (expected int, given {type(sys.argv[1])})") from exc
+
+        # optional second argument: nonzero runs the EMG pipeline in a separate process
+        if len(sys.argv) >= 3:
+            try:
+                emgProcess = bool(int(sys.argv[2]))
+            except Exception as exc:
+                raise ValueError(f"Wrong argument type (expected int, given {type(sys.argv[2])})") from exc
+
+        # optional third argument: a dynamic model exported with Dynamics2/Model_Export.py, run instead of the model checkpoint
+        if len(sys.argv) == 4:
+            exportedModel = sys.argv[3]
     else:
         raise ValueError(f"Wrong number of arguments ({len(sys.argv) - 1})")
 
-    main(usingEMG)
\ No newline at end of file
+    main(usingEMG, emgProcess, exportedModel)
\ No newline at end of file
@@ -0,0 +1,123 @@
+# LatencyStats.py
+# Low overhead latency histograms for timing the stages of the control pipeline
+#
+# Latencies are recorded in nanoseconds into log-linear buckets (HDR histogram style): values below 32 ns get a bucket
+# each, above that every power of two is split into 16 buckets, so any recorded value is known to within ~6%.
+# Recording is an integer bucket computation and a list increment - cheap enough to leave on in every loop.
+#
+# Each stage is written from a single thread, so no locking is done. Stages are registered on first use in the
+# module-level stageStats, which every module records into and main() dumps on request. A new stage can appear while
+# another thread reads them, so the readers iterate over a copy of the stages.
+
+import json
+import time
+
+class LatencyHistogram():
+    subBits = 4 # 2**subBits buckets per power of two
+    maxBits = 40 # values up to 2**40 ns (~18 minutes), longer ones land in the last bucket
+
+    def __init__(self):
+        self.subCount = 1 << self.subBits
+        self.numBuckets = (self.maxBits - self.subBits + 1)*self.subCount # the octave 2**(maxBits - 1) to 2**maxBits starts at index (maxBits - subBits)*subCount
+        self.reset()
+
+    def reset(self):
+        self.counts = [0]*self.numBuckets
+        self.count = 0
+        self.totalNs = 0
+        self.minNs = None
+        self.maxNs = 0
+
+    def bucketIndex(self, ns):
+        if ns < 2*self.subCount:
+            return ns
+        shift = ns.bit_length() - self.subBits - 1
+        return min(shift*self.subCount + (ns >> shift), self.numBuckets - 1)
+
+    def bucketLow(self, index):
+        # smallest value that falls in bucket index
+        if index < 2*self.subCount:
+            return index
+        shift = index//self.subCount - 1
+        return (index - shift*self.subCount) << shift
+
+    def record(self, ns):
+        if ns < 0:
+            ns = 0
+        self.counts[self.bucketIndex(ns)] += 1
+        self.count += 1
+        self.totalNs += ns
+        if self.minNs is None or ns < self.minNs:
+            self.minNs = ns
+        if ns > self.maxNs:
+            self.maxNs = ns
+
+    def percentile(self, p):
+        # upper edge of the bucket holding the p-th percentile (0 - 100), in ns
+        if self.count == 0:
+            return 0
+        rank = p/100*self.count
+        cumulative = 0
+        for index, n in enumerate(self.counts):
+            cumulative += n
+            if n and cumulative >= rank:
+                return min(self.bucketLow(index + 1) - 1, self.maxNs)
+        return self.maxNs
+
+    def summary(self):
+        # everything in microseconds, with the non-empty buckets as [lower edge, count] pairs
+        return {'count': self.count,
+                'mean_us': self.totalNs/max(self.count, 1)/1e3,
+                'min_us': (self.minNs or 0)/1e3,
+                'max_us': self.maxNs/1e3,
+                'p50_us': self.percentile(50)/1e3,
+                'p90_us': self.percentile(90)/1e3,
+                'p99_us': self.percentile(99)/1e3,
+                'p99.9_us': self.percentile(99.9)/1e3,
+                'buckets_us': [[self.bucketLow(i)/1e3, n] for i, n in enumerate(self.counts) if n]}
+
+class LatencyStats():
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.startTime = time.time()
+
+    def histogram(self, stage):
+        hist = self.stages.get(stage)
+        if hist is None:
+            hist = self.stages[stage] = LatencyHistogram()
+        return hist
+
+    def record(self, stage, ns):
+        # record one duration, e.g. stageStats.record('buildCommand', time.perf_counter_ns() - t0)
+        self.histogram(stage).record(ns)
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def reset(self):
+        for hist in list(self.stages.values()):
+            hist.reset()
+        self.counters = dict.fromkeys(list(self.counters), 0)
+        self.startTime = time.time()
+
+    def summary(self, extra=None):
+        # extra: other statistics to include, e.g. {'netScheduler': scheduler.stats()}
+        out = {'time': time.time(), 'since': self.startTime,
+               'stages': {stage: hist.summary() for stage, hist in list(self.stages.items())},
+               'counters': dict(self.counters)}
+        if extra is not None:
+            out.update(extra)
+        return out
+
+    def toJSON(self, extra=None, indent=None):
+        return json.dumps(self.summary(extra), indent=indent)
+
+    def printSummary(self):
+        print(f"{'stage':>16} | {'count':>8} | {'mean us':>9} | {'p50 us':>9} | {'p99 us':>9} | {'max us':>9}")
+        for stage, hist in list(self.stages.items()):
+            s = hist.summary()
+            print(f"{stage:>16} | {s['count']:8d} | {s['mean_us']:9.1f} | {s['p50_us']:9.1f} | {s['p99_us']:9.1f} | {s['max_us']:9.1f}")
+
+# shared by all modules of the controller
+stageStats = LatencyStats()
@@ -0,0 +1,69 @@
+# RateScheduler.py
+# Fixed-rate loop timing against absolute deadlines
+#
+# Tick k is due at epoch + k*period on the monotonic perf_counter_ns clock, so compute time and oversleeping in one
+# tick do not push back the ticks after it. Schedulers sharing an epoch (with rates that are multiples of each other)
+# stay phase-locked for as long as they run.
+
+import time
+
+class RateScheduler():
+    def __init__(self, rate, epoch=None, policy='skip'):
+        # rate: ticks per second
+        # epoch: perf_counter_ns() time of tick 0 - pass the epoch of another scheduler to phase-lock to it, by default tick 0 is now
+        # policy: what to do when a tick's deadline has already passed by a full period or more
+        #   'skip' drops the missed ticks and continues with the most recent one that is due
+        #   'catchup' runs every missed tick back to back, without sleeping, until it is on schedule again
+        if policy not in ['skip', 'catchup']:
+            raise ValueError(f'RateScheduler(): invalid policy {policy}')
+
+        self.rate = rate
+        self.periodNs = round(1e9/self.rate)
+        self.policy = policy
+
+        now = time.perf_counter_ns()
+        if epoch is None:
+            self.epoch = now
+            self.tick = -1 # so the first tick is tick 0, right away
+        else:
+            self.epoch = epoch
+            self.tick = (now - self.epoch)//self.periodNs # the first tick is the next one due on the shared schedule
+
+        self.resetStats()
+
+    def resetStats(self):
+        self.ticks = 0 # ticks run
+        self.overruns = 0 # ticks that were already due when wait() was called, i.e. the previous tick ran over its period
+        self.skipped = 0 # ticks dropped by the 'skip' policy
+        self.maxLateNs = 0 # worst delay between a deadline and the tick actually starting
+        self.totalLateNs = 0
+
+    def wait(self):
+        # block until the next tick is due and return its index
+        nextTick = self.tick + 1
+        deadline = self.epoch + nextTick*self.periodNs
+
+        now = time.perf_counter_ns()
+        if now < deadline:
+            time.sleep((deadline - now)/1e9)
+            now = time.perf_counter_ns()
+        else:
+            self.overruns += 1
+
+        lateNs = now - deadline
+        if self.policy == 'skip' and lateNs >= self.periodNs:
+            missed = lateNs//self.periodNs
+            nextTick += missed
+            self.skipped += missed
+            lateNs -= missed*self.periodNs
+
+        self.tick = nextTick
+        self.ticks += 1
+        self.maxLateNs = max(self.maxLateNs, lateNs)
+        self.totalLateNs += lateNs
+
+        return self.tick
+
+    def stats(self):
+        return {'rate': self.rate, 'policy': self.policy, 'ticks': self.ticks, 'overruns': self.overruns, 'skipped': self.skipped,
+                'maxLate_ms': self.maxLateNs/1e6, 'meanLate_ms': self.totalLateNs/max(self.ticks, 1)/1e6}
@@ -0,0 +1,50 @@
+# SensorStore.py
+# Named values (sensor readings, commands) backed by one preallocated array
+#
+# The name -> index map is fixed at construction, so hot paths can look up the indices they need once and then
+# read or write the array directly. Dict-style access by name still works for the printing helpers and the like.
+
+import numpy as np
+
+class SensorStore():
+    def __init__(self, names, initial=-1, dtype=float):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.values = np.full(len(self.names), initial, dtype=dtype)
+
+        self.seq = 0 # incremented every time new values are published
+        self.timestamp = 0 # timestamp of the message that last updated the values
+
+    def indices(self, names):
+        # positions of the named values in the array, for indexing values directly
+        return tuple(self.index[name] for name in names)
+
+    def publish(self, timestamp):
+        # mark the values as updated by the message received at timestamp
+        self.timestamp = timestamp
+        self.seq += 1
+
+    def get(self, indices):
+        # copy of the values at indices (a numpy array, e.g. from np.array(self.indices(names)))
+        return self.values[indices]
+
+    def __getitem__(self, name):
+        return self.values[self.index[name]]
+
+    def __setitem__(self, name, value):
+        self.values[self.index[name]] = value
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def keys(self):
+        return self.names.copy()
+
+    def __repr__(self):
+        return repr(dict(zip(self.names, self.values.tolist())))
@@ -0,0 +1,158 @@
+# SessionLogger.py
+# Stream fixed-width log rows to a .npy file while recording
+#
+# Rows of a numpy structured dtype are filled in place in a preallocated chunk. Full chunks are handed to a background
+# thread that appends their raw bytes to the file, so the control loop never formats or writes anything itself and
+# memory use does not grow with the length of the recording. The .npy header is written up front with room for any
+# row count and rewritten with the real count when the logger is closed; until then np.load would see 0 rows.
+#
+# Column names for each field are saved next to the data in a .json file with the same name. CSV is only made
+# offline, from a finished file, with exportCSV().
+
+import json
+import os
+import queue
+import sys
+import threading
+import numpy as np
+from numpy.lib import recfunctions
+
+npyMagic = b'\x93NUMPY\x01\x00' # format version 1.0
+
+def npyHeader(dtype, numRows, size=None):
+    # the .npy header of a 1D array of numRows rows of dtype, padded with spaces to size bytes (by default the size that fits any row count)
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.lib.format.dtype_to_descr(dtype), numRows)
+    if size is None:
+        longest = len(npyHeader(dtype, 10**19 - 1, size=0)) # 19 digit row count
+        size = -(-longest//64)*64 # data starts 64-byte aligned
+
+    if size == 0:
+        return npyMagic + b'\x00\x00' + header.encode('latin1') + b'\n'
+
+    headerLen = size - len(npyMagic) - 2
+    return npyMagic + headerLen.to_bytes(2, 'little') + header.ljust(headerLen - 1).encode('latin1') + b'\n'
+
+def metadataPath(path):
+    return os.path.splitext(path)[0] + '.json'
+
+class SessionLogger():
+    def __init__(self, path, dtype, columns=None, chunkSize=1024, metadata=None):
+        # path: .npy file to write
+        # columns: {field: [name of each element]} for the fields of dtype, saved with the data for exportCSV()
+        # metadata: anything else JSON serializable to save with the data
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.chunkSize = chunkSize
+        self.numRows = 0
+        self.closed = False
+
+        self.file = open(self.path, 'wb')
+        self.headerSize = len(npyHeader(self.dtype, 0))
+        self.file.write(npyHeader(self.dtype, 0))
+
+        self.metadata = {'columns': columns if columns is not None else {name: [name] for name in self.dtype.names}}
+        if metadata is not None:
+            self.metadata.update(metadata)
+
+        # chunks cycle between the logger (filling), the write queue and the free queue, so none are allocated while logging
+        self.chunk = np.zeros(self.chunkSize, dtype=self.dtype)
+        self.numInChunk = 0
+        self.writeQueue = queue.Queue()
+        self.freeChunks = queue.Queue()
+        self.freeChunks.put(np.zeros(self.chunkSize, dtype=self.dtype))
+
+        self.writeError = None
+        self.writer = threading.Thread(target=self.writeChunks)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def nextRow(self):
+        # the next row to fill in - a view into the current chunk, so assign to its fields directly
+        if self.numInChunk == self.chunkSize:
+            self.flushChunk()
+
+        row = self.chunk[self.numInChunk]
+        self.numInChunk += 1
+        self.numRows += 1
+        return row
+
+    def flushChunk(self):
+        self.writeQueue.put((self.chunk, self.numInChunk))
+        try:
+            self.chunk = self.freeChunks.get_nowait()
+        except queue.Empty:
+            self.chunk = np.zeros(self.chunkSize, dtype=self.dtype) # the writer has fallen behind
+        self.numInChunk = 0
+
+    def writeChunks(self):
+        while True:
+            item = self.writeQueue.get()
+            if item is None:
+                return
+
+            chunk, numRows = item
+            try:
+                self.file.write(memoryview(chunk[:numRows]).cast('B'))
+            except Exception as err:
+                self.writeError = err
+            self.freeChunks.put(chunk)
+
+    def close(self):
+        # write out everything logged and finalize the file
+        if self.closed:
+            return
+
+        if self.numInChunk > 0:
+            self.flushChunk()
+        self.writeQueue.put(None)
+        self.writer.join()
+
+        self.file.seek(0)
+        self.file.write(npyHeader(self.dtype, self.numRows, size=self.headerSize))
+        self.file.close()
+        self.closed = True
+
+        with open(metadataPath(self.path), 'w') as f:
+            json.dump(self.metadata, f, indent=1)
+
+        if self.writeError is not None:
+            raise IOError(f'close(): failed writing {self.path}') from self.writeError
+
+    def moveTo(self, path):
+        # rename the closed log (and its metadata) to path
+        if not self.closed:
+            raise ValueError('moveTo(): close the logger first')
+
+        os.replace(self.path, path)
+        os.replace(metadataPath(self.path), metadataPath(path))
+        self.path = path
+
+    def discard(self):
+        self.close()
+        os.remove(self.path)
+        os.remove(metadataPath(self.path))
+
+def exportCSV(path, csvPath=None, chunkRows=100000):
+    # convert a finished log to a tab separated text file with a title row, like the logs LUKEArm used to save directly
+    if csvPath is None:
+        csvPath = os.path.splitext(path)[0] + '.csv'
+
+    data = np.load(path, mmap_mode='r')
+    with open(metadataPath(path)) as f:
+        columns = json.load(f)['columns']
+    titles = [name for field in data.dtype.names for name in columns[field]]
+
+    with open(csvPath, 'w') as f:
+        f.write('\t'.join(titles) + '\n')
+        for start in range(0, len(data), chunkRows):
+            rows = recfunctions.structured_to_unstructured(np.asarray(data[start:start + chunkRows]))
+            np.savetxt(f, rows, delimiter='\t', fmt='%s')
+
+    return csvPath
+
+if __name__ == '__main__':
+    if len(sys.argv) not in [2, 3]:
+        print("Usage: python SessionLogger.py <log.npy> [out.csv]")
+        sys.exit(1)
+
+    print(f"Wrote {exportCSV(*sys.argv[1:])}")
@@ -0,0 +1,74 @@
+# SessionReader.py
+# Read recordings saved by SessionLogger without loading them into memory
+#
+# The .npy file is memory-mapped, so opening it only parses the header and data is paged in when it is used.
+# Time windows are found by bisecting the timestamp column, which touches a handful of rows instead of reading the
+# whole column (np.searchsorted would first copy the strided column out of the file).
+
+import bisect
+import json
+import numpy as np
+from SessionLogger import exportCSV, metadataPath
+
+class SessionReader():
+    def __init__(self, path):
+        self.path = path
+        self.data = np.load(self.path, mmap_mode='r')
+
+        with open(metadataPath(self.path)) as f:
+            self.metadata = json.load(f)
+        self.columns = self.metadata['columns'] # {field: [name of each element]}
+
+        # where each named column lives: name -> (field, element index or None for scalar fields)
+        self.columnIndex = {}
+        for field in self.data.dtype.names:
+            names = self.columns[field]
+            if self.data.dtype[field].shape == ():
+                self.columnIndex[names[0]] = (field, None)
+            else:
+                for i, name in enumerate(names):
+                    self.columnIndex[name] = (field, i)
+
+        self.timestamps = self.data['timestamp']
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, field):
+        # a whole field, e.g. reader['sensorPositions'] is [numRows x 8] - still backed by the file
+        return self.data[field]
+
+    @property
+    def fields(self):
+        return self.data.dtype.names
+
+    @property
+    def startTime(self):
+        return float(self.timestamps[0]) if len(self) else None
+
+    @property
+    def endTime(self):
+        return float(self.timestamps[-1]) if len(self) else None
+
+    def column(self, name, rows=None):
+        # one named column (e.g. 'indexPos', 'iEMG3', 'Timestamp'), for all rows or a slice of them
+        field, i = self.columnIndex[name]
+        values = self.data[field] if rows is None else self.data[rows][field]
+        return values if i is None else values[:, i]
+
+    def indexRange(self, start=None, stop=None):
+        # rows with start <= timestamp < stop, as a slice (timestamps are in the order they were logged)
+        first = 0 if start is None else bisect.bisect_left(self.timestamps, start)
+        last = len(self) if stop is None else bisect.bisect_left(self.timestamps, stop, lo=first)
+        return slice(first, last)
+
+    def window(self, start=None, stop=None, relative=False):
+        # the rows in a time range, as a memory-mapped view - relative=True counts start and stop from the first row
+        if relative and len(self):
+            start = None if start is None else start + self.startTime
+            stop = None if stop is None else stop + self.startTime
+
+        return self.data[self.indexRange(start, stop)]
+
+    def exportCSV(self, csvPath=None):
+        return exportCSV(self.path, csvPath)
@@ -19,8 +19,9 @@ from BesselFilter import BesselFilterArr
 from CausalButter import CausalButterArr, CausalButter
 
 class LUKEControllers:
-    def __init__(self, numMotors=8, freq_n=3, numElectrodes=16, LUKEArm=None, emg=None):
+    def __init__(self, numMotors=8, freq_n=3, numElectrodes=16, LUKEArm=None, emg=None, exportedModelPath=None):
         self.LUKEArm = LUKEArm
+        self.exportedModelPath = exportedModelPath # see resetModel
         self.emg = emg
         self.numMotors = numMotors
         self.freq_n = freq_n
@@ -58,6 +59,11 @@ class LUKEControllers:
         self.lastError = [0]*self.LUKEArm.numMotors
         self.windup = [100]*self.LUKEArm.numMotors
 
+        # buffer for the latest EMG frame - read once per model step so all fields come from the same processed frame
+        self.emgFrame = self.emg.frames.newFrame() if self.emg is not None else None
+        self.exportedModel = False # running a model from Dynamics2/Model_Export.py, see resetModel
+        self.emgTrace = (-1, 0.0, 0) # (frame sequence number, board OS_time, host recvTime) of the frame used by the last model step
+
         self.probFilter = BesselFilterArr(numChannels=3, order=4, critFreqs=[3], fs=self.LUKEArm.Hz, filtType='lowpass')
 
     # get the electrodes corresponding to the agonist and antagonist muscles for given motor/joint
@@ -205,9 +211,17 @@ class LUKEControllers:
         # print(f"newCom: {newCom}\n")
         return newCom
 
-    def resetModel(self):
+    def resetModel(self, exportedPath=None):
+        # exportedPath: a model exported with Dynamics2/Model_Export.py - the frozen TorchScript model is loaded instead of building the model from the checkpoint
+        # defaults to the exportedModelPath the controller was made with
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+        if exportedPath is None:
+            exportedPath = self.exportedModelPath
+        if exportedPath is not None:
+            self.loadExportedModel(exportedPath)
+            return
+
         # Build whole model based on muscles and masses
         learningRate = 5
         DoF = 5
@@ -220,18 +234,59 @@ class LUKEControllers:
         checkpoint = torch.load(self.model_save_path, map_location=self.device)
         self.system_dynamic_model.load_state_dict(checkpoint['model_state_dict'])
         self.system_dynamic_model.eval()
+        # upperExtremityModel is not part of this repository, so it only gets frozen (scaled parameters and constant tensors cached,
+        # see Hand_4dof.freeze) once it implements freeze() too - until then it runs exactly as before
+        if hasattr(self.system_dynamic_model, 'freeze'):
+            self.system_dynamic_model.freeze()
+
+        self.exportedModel = False
 
         # set initial conditions
         self.hidden = torch.FloatTensor([[0]*DoF*self.system_dynamic_model.numStates]).to(self.device)
 
+    def loadExportedModel(self, path):
+        # imported here, so the Dynamics2 on the path only needs Model_Export when an exported model is used
+        from Dynamics2.Model_Export import load_model
+
+        # the model was traced for one dt and one batch size, so check they match how it is run here
+        model, metadata = load_model(path, self.device)
+
+        if abs(metadata['dt'] - 1/self.LUKEArm.Hz) > 1e-9:
+            raise ValueError(f'loadExportedModel(): {path} was exported for dt = {metadata["dt"]}, but the model runs at {self.LUKEArm.Hz} Hz')
+        if metadata['batch_size'] != 1:
+            raise ValueError(f'loadExportedModel(): {path} was exported for batch size {metadata["batch_size"]}, not 1')
+
+        # forwardDynamics needs the joint angles, the system states and the movement probabilities - the Dynamics2 models in this
+        # repository (Hand_4dof, ...) only return the first two
+        numOutputs = metadata.get('num_outputs')
+        if numOutputs is None: # exported before num_outputs was saved, so count them from one step
+            with torch.no_grad():
+                outputs = model(torch.zeros((1, metadata['state_size']), dtype=torch.float, device=self.device),
+                                torch.zeros((1, metadata['input_size']), dtype=torch.float, device=self.device))
+            numOutputs = len(outputs) if isinstance(outputs, tuple) else 1
+        if numOutputs != 3:
+            raise ValueError(f'loadExportedModel(): {path} ({metadata["model"]}) returns {numOutputs} outputs, but the controller needs 3: joint angles, system states and movement probabilities')
+
+        self.system_dynamic_model = model
+        self.modelMetadata = metadata
+        self.exportedModel = True
+
+        # set initial conditions
+        self.hidden = torch.zeros((1, metadata['state_size']), dtype=torch.float, device=self.device)
+
     def forwardDynamics(self):
         # allEMG = self.emg.normedEMG
         # usedEMG = allEMG[self.usedChannels]
         # EMG = torch.FloatTensor([usedEMG]).to(self.device)
-        EMG = torch.FloatTensor(np.array([self.emg.synergyProd()])).to(self.device)
+        seq = self.emg.frames.read(self.emgFrame)
+        self.emgTrace = (seq, float(self.emg.frames.field(self.emgFrame, 'OS_time')[0]), int(self.emg.frames.field(self.emgFrame, 'recvTime')[0]))
+        EMG = torch.FloatTensor(np.array([self.emg.frames.field(self.emgFrame, 'synergies')])).to(self.device)
 
         with torch.no_grad():
-            jointAngles, self.hidden, predictions = self.system_dynamic_model(self.hidden, EMG, dt=1/self.LUKEArm.Hz)
+            if self.exportedModel:
+                jointAngles, self.hidden, predictions = self.system_dynamic_model(self.hidden, EMG) # dt is fixed in the exported model
+            else:
+                jointAngles, self.hidden, predictions = self.system_dynamic_model(self.hidden, EMG, dt=1/self.LUKEArm.Hz)
         jointAngles = jointAngles.detach().cpu().numpy()
         probabilities = predictions.detach().cpu().numpy()[0]
 
@@ -16,9 +16,12 @@ import zmq
     # send these commands to the arm (arbitrarily fast, knowing arm will only execute ~100 Hz commands)
 
 class LUKE_Command_Sender:
-    def __init__(self, socketAddr="tcp://127.0.0.1:1234"):
-        can.rc['interface'] = 'socketcan'
-        can.rc['channel'] = 'can0'
+    def __init__(self, socketAddr="tcp://127.0.0.1:1234", keepAlive=0.007, periodic=False, interface='socketcan', channel='can0', telemetryRate=1):
+        # periodic: instead of a send thread, let the CAN backend retransmit the frames every keepAlive seconds (bus.send_periodic)
+        # and just swap in new data when a command arrives (modify_data, see updatePeriodic)
+        # telemetryRate: how often (Hz) the current command and the counters below are printed, 0 to never print them
+        can.rc['interface'] = interface
+        can.rc['channel'] = channel
         can.rc['bitrate'] = 1000000
         can.rc['state'] = can.bus.BusState.PASSIVE
         try:
@@ -30,6 +33,26 @@ class LUKE_Command_Sender:
         self.dACI2 = None
         self.dACI3 = None
 
+        # the send thread waits on this until a new command arrives or the keep-alive deadline passes
+        # all three frames are only ever read or replaced while holding it, so a command is never sent half updated
+        self.commandReady = threading.Condition()
+        self.newCommand = False
+        self.keepAlive = keepAlive # resend the current command if no new one arrived for this long (s)
+
+        # reused for every send
+        self.messages = [can.Message(arbitration_id=arbID, data=bytearray(8), is_extended_id=False) for arbID in [0x210, 0x211, 0x212]]
+
+        self.periodic = periodic
+        self.periodicTasks = [] # one per frame - a periodic task can only send a single arbitration id
+
+        # telemetry - printing happens in its own thread so terminal output never holds up receiving or sending
+        self.telemetryRate = telemetryRate
+        self.telemetryThread = None
+        self.commandsReceived = 0
+        self.framesSent = 0 # only counted by the send thread, in periodic mode the backend sends the frames
+        self.lastSendTime = None
+        self.maxSendGap = 0 # longest time between two sends of the command (s)
+
         self.receiveThread = None
 
         self.ctx = zmq.Context()
@@ -59,15 +82,41 @@ class LUKE_Command_Sender:
 
     def printCommandHex(self):
         """ Print the commands in a nice format """
-        print(f'{time.time():.3f}', "[", ", ".join("{:02x}".format(i) for i in self.dACI1),
-             "] [", ", ".join("{:02x}".format(i) for i in self.dACI2),
-              "] [", ", ".join("{:02x}".format(i) for i in self.dACI3), "]")
+        with self.commandReady:
+            dACI1, dACI2, dACI3 = self.dACI1, self.dACI2, self.dACI3
+
+        print(f'{time.time():.3f}', "[", ", ".join("{:02x}".format(i) for i in dACI1),
+             "] [", ", ".join("{:02x}".format(i) for i in dACI2),
+              "] [", ", ".join("{:02x}".format(i) for i in dACI3), "]")
+
+    def printTelemetry(self):
+        """ Print the current command along with the send counters """
+        self.printCommandHex()
+        sent = 'periodic' if self.periodic else f'{self.framesSent} frames sent, max gap {1000*self.maxSendGap:.2f} ms'
+        print(f'\t{self.commandsReceived} commands received | {sent}')
+
+    def telemetry(self):
+        """ Print telemetry at telemetryRate until stopped """
+        while self.notStopped:
+            time.sleep(1/self.telemetryRate)
+            self.printTelemetry()
 
     def writeEmptyCommand(self):
         """ Write an empty command """
-        self.dACI1 = [0]*8
-        self.dACI2 = [0]*8
-        self.dACI3 = [0]*8
+        self.setCommand([0]*8, [0]*8, [0]*8)
+
+    def setCommand(self, dACI1, dACI2, dACI3):
+        """ Replace all three frames at once and wake the send thread """
+        with self.commandReady:
+            self.dACI1 = dACI1
+            self.dACI2 = dACI2
+            self.dACI3 = dACI3
+            self.newCommand = True
+            self.commandsReceived += 1
+            self.commandReady.notify()
+
+            if self.periodicTasks:
+                self.updatePeriodic()
 
     def startup(self):
         """ Ensure the arm will be started up with a "do nothing" command for safety """
@@ -76,10 +125,19 @@ class LUKE_Command_Sender:
         print("First message received - beginning communication with the arm")
 
         self.writeEmptyCommand()
+        self.commandsReceived = 0 # the empty command does not count
 
-        self.sendThread = threading.Thread(target=self.sendData)
-        self.sendThread.daemon = True
-        self.sendThread.start()
+        if self.telemetryRate > 0:
+            self.telemetryThread = threading.Thread(target=self.telemetry)
+            self.telemetryThread.daemon = True
+            self.telemetryThread.start()
+
+        if self.periodic:
+            self.startPeriodic()
+        else:
+            self.sendThread = threading.Thread(target=self.sendData)
+            self.sendThread.daemon = True
+            self.sendThread.start()
 
     def safetyCheck(self, commands):
         return len(commands) != 0 and commands[0:8] != [] and commands[8:16] != [] and commands[16:] != []
@@ -97,34 +155,71 @@ class LUKE_Command_Sender:
                 raise ValueError('receiveData(): problem with received data')
 
             # should be packing just a bunch of bytes, just access the right elements of the byte array here?
-            self.dACI1 = commands[0:8]
-            self.dACI2 = commands[8:16]
-            self.dACI3 = commands[16:]
-
-            self.printCommandHex()
+            self.setCommand(commands[0:8], commands[8:16], commands[16:])
 
-            if (self.dACI1 == [] or self.dACI2 == [] or self.dACI3 == []):
-                raise ValueError('receiveData(): empty commands send to arm')
+        with self.commandReady:
+            self.notStopped = False
+            self.commandReady.notify()
 
-        self.notStopped = False
+            if self.periodicTasks:
+                self.stopPeriodic()
         # self.sendThread.join()
         print("\nExiting...")
 
     def sendData(self):
-        """ Send the messages to the arm """
-        while self.notStopped:
-            ACI1 = can.Message(timestamp=time.time(), arbitration_id=0x210, data=self.dACI1, is_extended_id=False)
-            ACI2 = can.Message(timestamp=time.time(), arbitration_id=0x211, data=self.dACI2, is_extended_id=False)
-            ACI3 = can.Message(timestamp=time.time(), arbitration_id=0x212, data=self.dACI3, is_extended_id=False)
-            self.bus.send(ACI1, timeout=None)
-            self.bus.send(ACI2, timeout=None)
-            self.bus.send(ACI3, timeout=None)
-
-            time.sleep(0.007) # sleep for a little bit before sending the new message, give time to update
+        """ Send the messages to the arm as soon as a new command arrives, and at least every keepAlive seconds """
+        deadline = time.monotonic()
+        while True:
+            with self.commandReady:
+                self.commandReady.wait_for(lambda: self.newCommand or not self.notStopped, timeout=max(deadline - time.monotonic(), 0))
+                if not self.notStopped:
+                    break
+
+                self.newCommand = False
+                frames = (self.dACI1, self.dACI2, self.dACI3)
+
+            for message, data in zip(self.messages, frames):
+                message.data[:] = data
+                message.dlc = len(data)
+                message.timestamp = time.time()
+                self.bus.send(message, timeout=None)
+
+            now = time.monotonic()
+            if self.lastSendTime is not None:
+                self.maxSendGap = max(self.maxSendGap, now - self.lastSendTime)
+            self.lastSendTime = now
+            self.framesSent += len(self.messages)
+
+            deadline = now + self.keepAlive
+
+    def startPeriodic(self):
+        """ Register the frames of the current command as periodic tasks on the bus, once - new commands only modify them """
+        with self.commandReady:
+            for message, data in zip(self.messages, (self.dACI1, self.dACI2, self.dACI3)):
+                message.data[:] = data
+                message.dlc = len(data)
+                self.periodicTasks.append(self.bus.send_periodic(message, period=self.keepAlive))
+
+    def updatePeriodic(self):
+        """ Swap the current command into the periodic tasks, called with commandReady held
+        The three frames run on three independent timers, so they are never sent in step: after a new command, a task can send
+        its new frame while another still sends its old one until its own next period. Use the send thread (periodic=False)
+        if 0x210/0x211/0x212 must always go out together from the same command.
+        """
+        for task, message, data in zip(self.periodicTasks, self.messages, (self.dACI1, self.dACI2, self.dACI3)):
+            message.data[:] = data
+            message.dlc = len(data)
+            task.modify_data(message)
+
+    def stopPeriodic(self):
+        for task in self.periodicTasks:
+            task.stop()
+        self.periodicTasks = []
 
 if __name__ == "__main__":
     print("Waiting for arm to be turned on...")
 
     socketAddr = "tcp://127.0.0.1:1234"
-    sender = LUKE_Command_Sender(socketAddr=socketAddr)
+    periodic = bool(int(sys.argv[1])) if len(sys.argv) > 1 else False # 1 to hand retransmission to the CAN backend
+    sender = LUKE_Command_Sender(socketAddr=socketAddr, periodic=periodic)
     sender.receiveData()
\ No newline at end of file